@@ -1,11 +1,15 @@
 #!/usr/bin/env python
-import threading
 import logging
 import time
 import random
 import concurrent.futures
+import argparse
+from instrumentation import InstrumentedExecutor
+from queue_logging import setup_logging, LOG_MODES
+from lock_profiler import ProfiledLock, contention_report
 
-counter_lock = threading.Lock()
+# drop-in replacement for threading.Lock() recording wait and hold times
+counter_lock = ProfiledLock('counter_lock')
 counter = 0
 
 
@@ -16,22 +20,22 @@ def update_counter_context(i):
     """
     global counter
 
-    log.info(f'({i}): doing some preparation')
+    log.info('(%s): doing some preparation', i)
     time.sleep(random.uniform(0, THREADS))
 
-    log.info(f'({i}): acquiring lock')
+    log.info('(%s): acquiring lock', i)
     with counter_lock:
-        log.info(f'({i}): acquired lock')
+        log.info('(%s): acquired lock', i)
 
         val = counter
-        log.info(f'({i}): previous value: {val}')
+        log.info('(%s): previous value: %s', i, val)
 
         time.sleep(random.uniform(1.5, 1.6))
         val += 1
         counter = val
-        log.info(f'({i}): Done, set new value: {val}')
+        log.info('(%s): Done, set new value: %s', i, val)
 
-        log.info(f'({i}): releasing lock')
+        log.info('(%s): releasing lock', i)
     return i, val
 
 
@@ -41,25 +45,35 @@ log = logging.getLogger(__name__)
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Thread pool and as_completed() with instrumented executor')
+    parser.add_argument('--trace', help='write a timeline of all tasks in Chrome trace format to this file')
+    parser.add_argument('--log-mode', choices=LOG_MODES, default='sync', help='how log records are written')
+    args = parser.parse_args()
+
     # we want to log thread name
     f = logging.Formatter('%(asctime)s [%(levelname)s] [%(threadName)s] %(name)s: %(message)s')
-    h = logging.StreamHandler()
-    h.setFormatter(f)
-    log.addHandler(h)
+    # queue and json: records are formatted and written by a listener thread, not by the logging threads
+    setup_logging(log, f, mode=args.log_mode)
     log.setLevel(logging.INFO)
 
     # create a list of 'None' values for the return values
     results = [None] * THREADS
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+    # the instrumented executor records queue wait and run time of each task
+    # the contention report for counter_lock is logged once all tasks are done
+    with contention_report(counter_lock, logger=log), \
+            InstrumentedExecutor(concurrent.futures.ThreadPoolExecutor(max_workers=5), logger=log) as executor:
         log.info('creating tasks')
         futures = [executor.submit(update_counter_context, i) for i in range(THREADS)]
         log.info('tasks created')
         for completed_future in concurrent.futures.as_completed(futures):
             i, r = completed_future.result()
             results[i] = r
-            log.info(f'task {i} returned {results[i]}')
+            log.info(f'task {i} returned {results[i]}, {executor.progress_line()}')
 
+    executor.log_summary()
+    if args.trace:
+        executor.write_trace(args.trace)
     log.info(f'Done, final value: {counter}')
     for i in range(THREADS):
         log.info(f'task {i} returned {results[i]}')
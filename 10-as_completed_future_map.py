@@ -1,11 +1,15 @@
 #!/usr/bin/env python
-import threading
 import logging
 import time
 import random
 import concurrent.futures
+import argparse
+from instrumentation import InstrumentedExecutor
+from queue_logging import setup_logging, LOG_MODES
+from lock_profiler import ProfiledLock, contention_report
 
-counter_lock = threading.Lock()
+# drop-in replacement for threading.Lock() recording wait and hold times
+counter_lock = ProfiledLock('counter_lock')
 counter = 0
 
 
@@ -24,12 +28,12 @@ def update_counter_context():
         log.info('acquired lock')
 
         val = counter
-        log.info(f'previous value: {val}')
+        log.info('previous value: %s', val)
 
         time.sleep(random.uniform(1.5, 1.6))
         val += 1
         counter = val
-        log.info(f'Done, set new value: {val}')
+        log.info('Done, set new value: %s', val)
 
         log.info('releasing lock')
 
@@ -42,17 +46,24 @@ log = logging.getLogger(__name__)
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Thread pool and as_completed() with instrumented executor')
+    parser.add_argument('--trace', help='write a timeline of all tasks in Chrome trace format to this file')
+    parser.add_argument('--log-mode', choices=LOG_MODES, default='sync', help='how log records are written')
+    args = parser.parse_args()
+
     # we want to log thread name
     f = logging.Formatter('%(asctime)s [%(levelname)s] [%(threadName)s] %(name)s: %(message)s')
-    h = logging.StreamHandler()
-    h.setFormatter(f)
-    log.addHandler(h)
+    # queue and json: records are formatted and written by a listener thread, not by the logging threads
+    setup_logging(log, f, mode=args.log_mode)
     log.setLevel(logging.INFO)
 
     # create a list of 'None' values for the return values
     results = [None] * THREADS
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+    # the instrumented executor records queue wait and run time of each task
+    # the contention report for counter_lock is logged once all tasks are done
+    with contention_report(counter_lock, logger=log), \
+            InstrumentedExecutor(concurrent.futures.ThreadPoolExecutor(max_workers=5), logger=log) as executor:
         log.info('creating tasks')
         # create a dictionary which allows to map from future to task
         # we need this map b/c as_completed() returns a future and we want a way to determine the task number for
@@ -69,8 +80,11 @@ def main():
             i = future_map[completed_future]
             r = completed_future.result()
             results[i] = r
-            log.info(f'task {i} returned {results[i]}')
+            log.info(f'task {i} returned {results[i]}, {executor.progress_line()}')
 
+    executor.log_summary()
+    if args.trace:
+        executor.write_trace(args.trace)
     log.info(f'Done, final value: {counter}')
     for i in range(THREADS):
         log.info(f'task {i} returned {results[i]}')
@@ -1,38 +1,517 @@
 #!/usr/bin/env python
 import requests
+import requests.adapters
 from bs4 import BeautifulSoup
 import logging
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 import time
 import threading
+import queue
+import itertools
+import sys
 import concurrent.futures
+import argparse
+import tempfile
+import os
+import json
+import hashlib
+import gzip
+import tracemalloc
+import collections
+import datetime
+import email.utils
+import re
+import math
+import random
+import contextlib
+import lxml.etree
+import http.server
+import asyncio
+import aiohttp
+from instrumentation import InstrumentedExecutor
+from queue_logging import setup_logging, LOG_MODES
 
 log = logging.getLogger(__name__)
 
 FN_BASE_PAGE = 'https://www.cisco.com/c/en/us/support/web/tsd-products-field-notice-summary.html'
 
+# saved copy of a summary page with all sorts of corner cases; used to verify the parsers
+FN_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'field-notice-summary.html')
 
-def get_page(url):
+FN_DATE = re.compile(r'\b\d{1,2}-[A-Z][a-z]{2}-\d{4}\b')
+
+# URL of a field notice and the date of the last update as shown on the summary page
+FieldNotice = collections.namedtuple('FieldNotice', ['url', 'updated'])
+
+
+def parse_fn_date(text):
+    """
+    Find a date like 30-Jun-2020 in given text
+    :param text: text to search
+    :return: datetime.date or None if no date was found
+    """
+    date = FN_DATE.search(text) if text else None
+    return date and datetime.datetime.strptime(date.group(0), '%d-%b-%Y').date()
+
+
+def make_session(pool_size=10):
+    """
+    Create a session with a connection pool large enough to serve pool_size concurrent requests to the same host
+    :param pool_size: max number of connections kept open per host; should match the number of worker threads
+    :return: requests session
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+CachedPage = collections.namedtuple('CachedPage', ['body', 'etag', 'last_modified', 'expires'])
+
+
+class PageCache:
+    """
+    Persistent on-disk cache of pages keyed by URL. For each URL the body is stored together with ETag and
+    Last-Modified so that cached pages can be revalidated using a conditional GET. The total size of all cached bodies
+    is capped; least recently used pages are evicted first.
+    Counts hits (still fresh, no request), misses (full download) and revalidations (304, body served from disk).
+    Can be used as context manager; the index is saved on exit.
+    """
+
+    def __init__(self, directory, max_size=100 * 2 ** 20):
+        """
+        :param directory: cache directory; created if it doesn't exist
+        :param max_size: max total size of cached bodies in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.index_path = os.path.join(directory, 'index.json')
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        os.makedirs(directory, exist_ok=True)
+        # URL -> entry; order is LRU order: least recently used first
+        self.index = collections.OrderedDict()
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                self.index.update(json.load(f))
+        self.size = sum(entry['size'] for entry in self.index.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.save()
+
+    def save(self):
+        """
+        Write the index to disk
+        """
+        with self.lock:
+            tmp = f'{self.index_path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.index, f)
+            os.replace(tmp, self.index_path)
+
+    def body_path(self, url):
+        return os.path.join(self.directory, f'{hashlib.sha256(url.encode()).hexdigest()}.html')
+
+    def lookup(self, url):
+        """
+        Get a cached page
+        :param url: URL
+        :return: CachedPage or None if URL is not cached
+        """
+        with self.lock:
+            entry = self.index.get(url)
+            if entry is None:
+                return None
+            self.index.move_to_end(url)
+            try:
+                with open(self.body_path(url), encoding='utf-8') as f:
+                    body = f.read()
+            except FileNotFoundError:
+                # somebody messed with the cache directory
+                self.size -= self.index.pop(url)['size']
+                return None
+        return CachedPage(body=body, etag=entry['etag'], last_modified=entry['last_modified'],
+                          expires=entry['expires'])
+
+    @staticmethod
+    def request_headers(cached):
+        """
+        Headers for a conditional GET to revalidate a cached page
+        :param cached: CachedPage
+        :return: dict of headers
+        """
+        headers = {}
+        if cached.etag:
+            headers['If-None-Match'] = cached.etag
+        if cached.last_modified:
+            headers['If-Modified-Since'] = cached.last_modified
+        return headers
+
+    @staticmethod
+    def expires(headers):
+        """
+        Determine until when a response is fresh based on Cache-Control: max-age
+        :param headers: response headers
+        :return: expiry as time.time() value; 0 if the response has to be revalidated right away
+        """
+        cache_control = headers.get('Cache-Control', '')
+        if 'no-cache' in cache_control or 'no-store' in cache_control:
+            return 0
+        max_age = re.search(r'max-age=(\d+)', cache_control)
+        return time.time() + int(max_age.group(1)) if max_age else 0
+
+    def store(self, url, body, headers):
+        """
+        Put a page into the cache and evict least recently used pages if the cache gets too large
+        :param url: URL
+        :param body: page markup
+        :param headers: response headers
+        """
+        size = len(body.encode('utf-8'))
+        if size > self.max_size:
+            return
+        with self.lock:
+            with open(self.body_path(url), 'w', encoding='utf-8') as f:
+                f.write(body)
+            old = self.index.pop(url, None)
+            if old:
+                self.size -= old['size']
+            self.index[url] = {'etag': headers.get('ETag'),
+                               'last_modified': headers.get('Last-Modified'),
+                               'expires': self.expires(headers),
+                               'size': size}
+            self.size += size
+            while self.size > self.max_size:
+                evicted_url, evicted = self.index.popitem(last=False)
+                self.size -= evicted['size']
+                os.remove(self.body_path(evicted_url))
+
+    def refresh(self, url, headers):
+        """
+        Update the expiry of a cached page after a successful revalidation
+        :param url: URL
+        :param headers: headers of the 304 response
+        """
+        with self.lock:
+            entry = self.index.get(url)
+            if entry:
+                entry['expires'] = self.expires(headers)
+
+    def count(self, kind):
+        with self.lock:
+            self.stats[kind] += 1
+
+    def log_stats(self, mode):
+        """
+        Log and reset hit/miss/revalidated counts and save the index
+        :param mode: crawl mode for the log message
+        """
+        with self.lock:
+            stats = self.stats
+            self.stats = collections.Counter()
+        log.info(f'{mode}: cache {stats["hit"]} hits, {stats["miss"]} misses, {stats["revalidated"]} revalidated, '
+                 f'{len(self.index)} pages/{self.size / 2 ** 20:.1f}MiB cached')
+        self.save()
+
+
+class RetryPolicy:
+    """
+    Retry failed requests with exponential backoff and jitter. Honors Retry-After. Keeps thread safe statistics of
+    retries and time spent in backoff
+    """
+    # HTTP status codes worth a retry
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, retries=3, backoff=0.5, max_backoff=30.0):
+        """
+        :param retries: max number of retries per request
+        :param backoff: base delay in seconds; the delay before retry n is random between 0 and backoff * 2 ** n
+        :param max_backoff: upper bound of the delay in seconds
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        self.backoff_time = 0.0
+
+    def should_retry(self, e, attempt):
+        """
+        Determine whether a failed request should be retried
+        :param e: requests exception
+        :param attempt: number of retries so far
+        :return: True if the request should be retried
+        """
+        if attempt >= self.retries:
+            if attempt:
+                self.count('given_up')
+            return False
+        if isinstance(e, requests.HTTPError):
+            return e.response.status_code in self.RETRY_STATUS
+        return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+    @staticmethod
+    def retry_after(response):
+        """
+        Get the delay requested by the server
+        :param response: response or None
+        :return: delay in seconds or None
+        """
+        value = response is not None and response.headers.get('Retry-After')
+        if not value:
+            return None
+        if value.isdigit():
+            return float(value)
+        try:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def delay(self, e, attempt):
+        """
+        Determine the delay before the next retry
+        :param e: requests exception
+        :param attempt: number of retries so far
+        :return: delay in seconds
+        """
+        delay = self.retry_after(getattr(e, 'response', None))
+        if delay is None:
+            # exponential backoff with "full jitter"
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        with self.lock:
+            self.stats['retries'] += 1
+            self.backoff_time += delay
+        return delay
+
+    def count(self, kind):
+        with self.lock:
+            self.stats[kind] += 1
+
+    def log_stats(self, mode):
+        """
+        Log and reset retry statistics
+        :param mode: crawl mode for the log message
+        """
+        with self.lock:
+            stats, backoff_time = self.stats, self.backoff_time
+            self.stats, self.backoff_time = collections.Counter(), 0.0
+        log.info(f'{mode}: {stats["retries"]} retries, {backoff_time * 1000:.3f}ms in backoff, '
+                 f'gave up on {stats["given_up"]} requests')
+
+
+class HostRateLimiter:
+    """
+    Token bucket rate limit per host shared by all threads
+    """
+
+    def __init__(self, rate=10.0, burst=10):
+        """
+        :param rate: requests per second per host
+        :param burst: max number of requests per host which can be sent w/o waiting
+        """
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        # host -> [tokens, time of last update]
+        self.buckets = {}
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def acquire(self, url):
+        """
+        Wait until a request to the host of given URL is allowed
+        :param url: URL
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            tokens, last = self.buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate) - 1
+            self.buckets[host] = (tokens, now)
+            # tokens can get negative: each waiting thread has reserved its slot
+            wait = -tokens / self.rate if tokens < 0 else 0.0
+            if wait:
+                self.waits += 1
+                self.wait_time += wait
+        if wait:
+            time.sleep(wait)
+
+    def log_stats(self, mode):
+        """
+        Log and reset rate limiter statistics
+        :param mode: crawl mode for the log message
+        """
+        with self.lock:
+            waits, wait_time = self.waits, self.wait_time
+            self.waits, self.wait_time = 0, 0.0
+        log.info(f'{mode}: rate limit delayed {waits} requests by {wait_time * 1000:.3f}ms in total')
+
+
+class NoticeStore:
+    """
+    Append-only compressed store for crawled pages. Each page is written as a separate gzip member to the data file as
+    soon as it is retrieved. An index file next to the data file records URL, offset and length of each record in JSON
+    lines so that a single page can be read w/o decompressing the whole file. As the data file is just a sequence of
+    gzip members it can also be read with zcat. Safe to use from multiple threads.
+    Can be used as context manager.
+    """
+
+    def __init__(self, path, compresslevel=6):
+        """
+        :param path: path of the data file; the index is stored in path + '.idx'
+        :param compresslevel: gzip compression level
+        """
+        self.path = path
+        self.index_path = f'{path}.idx'
+        self.compresslevel = compresslevel
+        self.lock = threading.Lock()
+        # URL -> (offset, length); for URLs stored multiple times the last record wins
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                for line in f:
+                    record = json.loads(line)
+                    self.index[record['url']] = (record['offset'], record['length'])
+        self.data = open(path, 'ab')
+        self.index_file = open(self.index_path, 'a')
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.data.close()
+            self.index_file.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def urls(self):
+        return list(self.index)
+
+    def append(self, url, page):
+        """
+        Compress and append a page
+        :param url: URL of the page
+        :param page: markup
+        """
+        raw = page.encode('utf-8')
+        # compress outside of the lock: zlib releases the GIL and other threads can write in the meantime
+        record = gzip.compress(raw, compresslevel=self.compresslevel)
+        with self.lock:
+            offset = self.data.tell()
+            self.data.write(record)
+            self.data.flush()
+            self.index_file.write(json.dumps({'url': url, 'offset': offset, 'length': len(record)}) + '\n')
+            self.index_file.flush()
+            self.index[url] = (offset, len(record))
+            self.bytes_in += len(raw)
+            self.bytes_out += len(record)
+
+    def read(self, url):
+        """
+        Random access to a single page
+        :param url: URL of the page
+        :return: markup
+        """
+        offset, length = self.index[url]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return gzip.decompress(f.read(length)).decode('utf-8')
+
+    def log_stats(self, mode):
+        with self.lock:
+            bytes_in, bytes_out = self.bytes_in, self.bytes_out
+            self.bytes_in = self.bytes_out = 0
+        log.info(f'{mode}: stored {bytes_in / 2 ** 20:.1f}MiB compressed to {bytes_out / 2 ** 20:.1f}MiB, '
+                 f'{len(self)} pages in {self.path}')
+
+
+def log_crawl_stats(mode, cache=None, retry=None, rate_limiter=None, sink=None):
+    """
+    Log statistics of cache, retry policy, rate limiter and result store at the end of a crawl
+    :param mode: crawl mode for the log message
+    """
+    for stats in (cache, retry, rate_limiter, sink):
+        if stats is not None:
+            stats.log_stats(mode)
+
+
+def get_page(url, session=None, cache=None, retry=None, rate_limiter=None, report=None):
     """
     GET the page via given URL and return markuo
     :param url: URL to access
+    :param session: session to use. If None then a new session is created (and closed) for this single request
+    :param cache: optional PageCache; cached pages are revalidated using a conditional GET
+    :param retry: optional RetryPolicy; w/o policy failed requests are not retried
+    :param rate_limiter: optional HostRateLimiter
+    :param report: optional callable; called with 'hit' if the page is served from cache w/o a request and with
+        'retry' before each retry of a failed (e.g. throttled) request
     :return: markup of retrieved web page
     """
-    with requests.Session() as session:
-        start = time.perf_counter()
+    if session is None:
+        # a fresh session means a fresh connection: TCP (and TLS) handshake for every single page
+        with requests.Session() as session:
+            return get_page(url, session=session, cache=cache, retry=retry, rate_limiter=rate_limiter, report=report)
+    start = time.perf_counter()
+    cached = cache and cache.lookup(url)
+    if cached and cached.expires > time.time():
+        cache.count('hit')
+        if report:
+            report('hit')
+        log.info(f'got page for {url} from cache, {(time.perf_counter() - start) * 1000:.3f}ms')
+        return cached.body
+    attempt = 0
+    while True:
+        if rate_limiter:
+            rate_limiter.acquire(url)
         log.info(f'GET on {url}')
-        r = session.get(url=url)
-        r.raise_for_status()
-        log.info(f'got page for {url}, {(time.perf_counter() - start) * 1000:.3f}ms')
+        try:
+            r = session.get(url=url, headers=cached and cache.request_headers(cached))
+            if not (cached and r.status_code == 304):
+                r.raise_for_status()
+        except requests.RequestException as e:
+            if not (retry and retry.should_retry(e, attempt)):
+                raise
+            delay = retry.delay(e, attempt)
+            attempt += 1
+            if report:
+                report('retry')
+            log.warning(f'GET on {url} failed: {e}, retry {attempt} in {delay * 1000:.3f}ms')
+            time.sleep(delay)
+            continue
+        break
+    if cached and r.status_code == 304:
+        cache.count('revalidated')
+        cache.refresh(url, r.headers)
+        log.info(f'got page for {url}, not modified, {(time.perf_counter() - start) * 1000:.3f}ms')
+        return cached.body
+    if cache:
+        cache.count('miss')
+        cache.store(url, r.text, r.headers)
+    log.info(f'got page for {url}, {(time.perf_counter() - start) * 1000:.3f}ms')
     return r.text
 
 
-def get_field_notice_urls():
+def parse_field_notice_urls_soup(page, base_url=FN_BASE_PAGE):
     """
-    Access page with Cisco fields notices and extract all URLs of recent field notices
-    :return: list of fields notice URLs
+    Extract field notices from the summary page using BeautifulSoup
+    :param page: markup of the field notice summary page
+    :param base_url: URL of the field notice summary page; used to determine full URLs
+    :return: list of FieldNotice tuples: URL and date of last update
     """
-    page = get_page(url=FN_BASE_PAGE)
     log.info('Cooking soup')
     soup = BeautifulSoup(markup=page, features='lxml')
     """
@@ -52,70 +531,1248 @@ def get_field_notice_urls():
     li = soup.find_all(li_with_most_recent_link_title_span)
     log.info(f'found {len(li)} field notices')
 
-    # determine full urls from href values
-    urls = [urljoin(FN_BASE_PAGE, l.a['href']) for l in li]
-    return urls
+    # determine full urls from href values and get the update date from the span next to the link
+    notices = [FieldNotice(url=urljoin(base_url, l.a['href']),
+                           updated=parse_fn_date((date := l.find('span', class_='most_recent_link_date')) and
+                                                 date.get_text()))
+               for l in li]
+    return notices
+
 
+# Same selection as li_with_most_recent_link_title_span() in parse_field_notice_urls_soup(): all <li> where the first
+# class of the first <span> (at any depth) is most_recent_link_title. XPath expressions are compiled only once
+FN_LI_XPATH = lxml.etree.XPath(
+    "//li[substring-before(concat(normalize-space((.//span)[1]/@class), ' '), ' ') = 'most_recent_link_title']")
+FN_HREF_XPATH = lxml.etree.XPath('string((.//a)[1]/@href)')
+FN_DATE_XPATH = lxml.etree.XPath(
+    "string((.//span[contains(concat(' ', normalize-space(@class), ' '), ' most_recent_link_date ')])[1])")
 
-def get_field_notices_sync(urls):
+
+def parse_field_notice_urls_lxml(page, base_url=FN_BASE_PAGE):
+    """
+    Extract field notices from the summary page using compiled XPath expressions on a plain lxml tree. Much faster than
+    parse_field_notice_urls_soup() and returns the same result
+    :param page: markup of the field notice summary page
+    :param base_url: URL of the field notice summary page; used to determine full URLs
+    :return: list of FieldNotice tuples: URL and date of last update
+    """
+    root = lxml.etree.HTML(page)
+    if root is None:
+        # empty page
+        return []
+    notices = [FieldNotice(url=urljoin(base_url, FN_HREF_XPATH(li)),
+                           updated=parse_fn_date(FN_DATE_XPATH(li)))
+               for li in FN_LI_XPATH(root)]
+    log.info(f'found {len(notices)} field notices')
+    return notices
+
+
+def get_field_notice_urls(base_url=FN_BASE_PAGE, parser=parse_field_notice_urls_lxml, retry=None):
+    """
+    Access page with Cisco fields notices and extract all URLs of recent field notices
+    :param base_url: URL of the field notice summary page
+    :param parser: parse_field_notice_urls_lxml() or parse_field_notice_urls_soup()
+    :param retry: optional RetryPolicy
+    :return: list of FieldNotice tuples: URL and date of last update
+    """
+    page = get_page(url=base_url, retry=retry)
+    return parser(page, base_url=base_url)
+
+
+def load_crawl_state(state_file):
+    """
+    Read state of the last crawl
+    :param state_file: path of state file
+    :return: dict with 'last_crawl' (ISO timestamp or None) and 'notices' (URL -> ISO date of last update)
+    """
+    if not os.path.exists(state_file):
+        return {'last_crawl': None, 'notices': {}}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def save_crawl_state(state_file, state):
+    """
+    Write state of the last crawl
+    :param state_file: path of state file
+    :param state: dict with 'last_crawl' and 'notices'
+    """
+    tmp = f'{state_file}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, state_file)
+
+
+def get_field_notices_delta(notices, state_file, max_workers=10, cache=None, retry=None, rate_limiter=None):
+    """
+    Incremental crawl: only retrieve field notices which are new or have been updated since they were last retrieved.
+    The date of the last update of each retrieved field notice is persisted in a state file
+    :param notices: list of FieldNotice tuples as returned by get_field_notice_urls()
+    :param state_file: path of state file
+    :param max_workers: number of worker threads
+    :param cache: optional PageCache
+    :param retry: optional RetryPolicy
+    :param rate_limiter: optional HostRateLimiter
+    :return: dict URL -> page for all retrieved field notices
+    """
+    start = time.perf_counter()
+    state = load_crawl_state(state_file)
+    known = state['notices']
+
+    def needs_update(notice):
+        # notices w/o date are always retrieved
+        last = known.get(notice.url)
+        return notice.updated is None or last is None or notice.updated.isoformat() > last
+
+    delta = [notice for notice in notices if needs_update(notice)]
+    log.info(f'Delta: {len(delta)} of {len(notices)} field notices are new or updated since last crawl '
+             f'({state["last_crawl"]})')
+    pages = get_field_notices_threaded([notice.url for notice in delta], max_workers=max_workers, cache=cache,
+                                       retry=retry, rate_limiter=rate_limiter)
+
+    # only remember field notices we actually got; failed ones are retried next time
+    for notice, page in zip(delta, pages):
+        if page is not None:
+            known[notice.url] = notice.updated and notice.updated.isoformat()
+    state['last_crawl'] = datetime.datetime.now().isoformat(timespec='seconds')
+    save_crawl_state(state_file, state)
+    log.info(f'Delta: got {len(delta)} of {len(notices)} field notices in '
+             f'{(time.perf_counter() - start) * 1000:.3f}ms')
+    return {notice.url: page for notice, page in zip(delta, pages) if page is not None}
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process since it was started; includes everything which ran before the caller
+    :return: peak RSS in bytes; None if not available (the resource module only exists on Unix)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KiB
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_field_notices_sync(urls, cache=None, retry=None, rate_limiter=None):
     """
     Retrieve all field notices synchronously
     :param urls:  list of field notice URLs
+    :param cache: optional PageCache
+    :param retry: optional RetryPolicy
+    :param rate_limiter: optional HostRateLimiter
     :return: None
     """
     start = time.perf_counter()
     for i, url in enumerate(urls):
         try:
-            r = get_page(url)
+            r = get_page(url, cache=cache, retry=retry, rate_limiter=rate_limiter)
         except Exception as e:
             log.error(f'Getting {url} failed: {e}')
         else:
             log.info(f'url {i} \'{urls[i]}\': {len(r)} bytes')
     log.info(f'Sync: got {len(urls)} field notices in {(time.perf_counter() - start) * 1000:.3f}ms')
+    log_crawl_stats('Sync', cache, retry, rate_limiter)
 
 
-def get_field_notices_threaded(urls):
+def get_field_notices_threaded(urls, max_workers=10, cache=None, retry=None, rate_limiter=None, sink=None):
     """
-    Retrieve all field notices. Create on thread for each URL
+    Retrieve all field notices. A fixed number of worker threads take URLs from a work queue
     :param urls:  list of field notice URLs
-    :return: None
+    :param max_workers: number of worker threads
+    :param cache: optional PageCache
+    :param retry: optional RetryPolicy
+    :param rate_limiter: optional HostRateLimiter
+    :param sink: optional NoticeStore; pages are written to the store as soon as they are retrieved
+    :return: list of field notice pages (page sizes if a sink is given); None for pages which could not be retrieved
     """
     start = time.perf_counter()
-    threads = [threading.Thread(target=get_page, args=(url,)) for url in urls]
+    work = queue.Queue()
+    for i, url in enumerate(urls):
+        work.put((i, url))
+    results = [None] * len(urls)
+
+    def worker():
+        while True:
+            try:
+                i, url = work.get_nowait()
+            except queue.Empty:
+                # no more work
+                return
+            try:
+                page = get_page(url, cache=cache, retry=retry, rate_limiter=rate_limiter)
+            except Exception as e:
+                log.error(f'Getting {url} failed: {e}')
+                continue
+            log.info(f'url {i} \'{url}\': {len(page)} bytes')
+            if sink is not None:
+                sink.append(url, page)
+                results[i] = len(page)
+            else:
+                results[i] = page
+
+    # threads which existed before the crawl (e.g. of a mock server) don't count
+    baseline_threads = threading.active_count()
+    threads = [threading.Thread(target=worker, name=f'Worker-{n}') for n in range(min(max_workers, len(urls)))]
     [t.start() for t in threads]
-    [t.join() for t in threads]
-    log.info(f'Threaded: got {len(urls)} field notices in {(time.perf_counter() - start) * 1000:.3f}ms')
+    peak_threads = threading.active_count() - baseline_threads
+    # sample the number of threads while the workers run
+    for t in threads:
+        while t.is_alive():
+            t.join(0.05)
+            peak_threads = max(peak_threads, threading.active_count() - baseline_threads)
 
+    rss = peak_rss()
+    log.info(f'Threaded: got {len(urls)} field notices in {(time.perf_counter() - start) * 1000:.3f}ms, '
+             f'peak {peak_threads} additional threads' +
+             (f', process peak RSS so far {rss / 2 ** 20:.1f}MiB' if rss is not None else ''))
+    log_crawl_stats('Threaded', cache, retry, rate_limiter, sink)
+    return results
 
-def get_field_notices_futures(urls):
+
+def get_field_notices_futures(urls, cache=None, retry=None, rate_limiter=None, sink=None, trace=None):
     """
-    Retrieve all field notices using ThreadPoolExecutor and retrieve results using as_completed()
+    Retrieve all field notices using ThreadPoolExecutor and retrieve results using as_completed(). The executor is
+    instrumented: progress is logged with each result and queue wait, run time and stragglers at the end.
     :param urls:  list of field notice URLs
+    :param cache: optional PageCache
+    :param retry: optional RetryPolicy
+    :param rate_limiter: optional HostRateLimiter
+    :param sink: optional NoticeStore; pages are written to the store by the worker threads and are not kept in memory
+    :param trace: optional path of a Chrome trace file with the timeline of all requests
     :return: None
     """
+
+    def fetch(url):
+        page = get_page(url, cache=cache, retry=retry, rate_limiter=rate_limiter)
+        if sink is not None:
+            sink.append(url, page)
+            # the future only holds the page size
+            return len(page)
+        return page
+
     start = time.perf_counter()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=10) as executor:
-        future_map = {executor.submit(get_page, url): i for i, url in enumerate(urls)}
+    with InstrumentedExecutor(concurrent.futures.ThreadPoolExecutor(max_workers=10), name='Futures thread',
+                              logger=log) as executor:
+        future_map = {executor.submit(fetch, url): i for i, url in enumerate(urls)}
         for completed_future in concurrent.futures.as_completed(future_map):
             i = future_map[completed_future]
-            r = completed_future.result()
-            log.info(f'url {i} \'{urls[i]}\': {len(r)} bytes')
+            try:
+                r = completed_future.result()
+            except Exception as e:
+                log.error(f'Getting {urls[i]} failed: {e}')
+            else:
+                log.info(f'url {i} \'{urls[i]}\': {len(r) if sink is None else r} bytes, {executor.progress_line()}')
     log.info(f'Futures thread: got {len(urls)} field notices in {(time.perf_counter() - start) * 1000:.3f}ms')
+    executor.log_summary()
+    if trace:
+        executor.write_trace(trace)
+    log_crawl_stats('Futures thread', cache, retry, rate_limiter, sink)
 
 
-if __name__ == '__main__':
-    f = logging.Formatter('%(asctime)s [%(levelname)s] [%(threadName)s] %(name)s: %(message)s')
-    h = logging.StreamHandler()
-    h.setFormatter(f)
-    log.addHandler(h)
-    log.setLevel(logging.INFO)
+def get_field_notices_pooled(urls, max_workers=10, per_thread_session=False, cache=None, retry=None,
+                             rate_limiter=None):
+    """
+    Retrieve all field notices using ThreadPoolExecutor. Other than get_field_notices_futures() connections are reused:
+    either all threads share one session with a connection pool sized to match the number of workers or each thread
+    has its own session.
+    :param urls:  list of field notice URLs
+    :param max_workers: number of worker threads
+    :param per_thread_session: use one session per thread instead of a single shared session
+    :param cache: optional PageCache
+    :param retry: optional RetryPolicy
+    :param rate_limiter: optional HostRateLimiter
+    :return: None
+    """
+    start = time.perf_counter()
+    if per_thread_session:
+        # each worker thread lazily creates its own session; we keep track of all sessions so that we can close them
+        thread_local = threading.local()
+        sessions = []
+        sessions_lock = threading.Lock()
+
+        def get_page_thread_session(url):
+            session = getattr(thread_local, 'session', None)
+            if session is None:
+                session = thread_local.session = make_session(pool_size=1)
+                with sessions_lock:
+                    sessions.append(session)
+            return get_page(url, session=session, cache=cache, retry=retry, rate_limiter=rate_limiter)
+
+        fetch = get_page_thread_session
+    else:
+        shared_session = make_session(pool_size=max_workers)
+        sessions = [shared_session]
+
+        def fetch(url):
+            return get_page(url, session=shared_session, cache=cache, retry=retry, rate_limiter=rate_limiter)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_map = {executor.submit(fetch, url): i for i, url in enumerate(urls)}
+            for completed_future in concurrent.futures.as_completed(future_map):
+                i = future_map[completed_future]
+                try:
+                    r = completed_future.result()
+                except Exception as e:
+                    log.error(f'Getting {urls[i]} failed: {e}')
+                else:
+                    log.info(f'url {i} \'{urls[i]}\': {len(r)} bytes')
+    finally:
+        for session in sessions:
+            session.close()
+    mode = 'per thread session' if per_thread_session else 'shared session'
+    log.info(f'Pooled ({mode}): got {len(urls)} field notices in {(time.perf_counter() - start) * 1000:.3f}ms')
+    log_crawl_stats(f'Pooled ({mode})', cache, retry, rate_limiter)
+
+
+class AIMDLimiter:
+    """
+    Limit the number of in-flight requests. The limit is adjusted while the crawl runs: additive increase as long as
+    latency stays flat, multiplicative decrease on errors (429, 5xx, connection errors) or latency spikes. With a
+    retry policy failed requests are retried inside get_page(): each retry is reported to the limiter via throttled().
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=100, decrease=0.5, latency_factor=2.0):
+        """
+        :param initial: initial limit
+        :param minimum: lower bound of the limit
+        :param maximum: upper bound of the limit
+        :param decrease: factor applied to the limit on errors or latency spikes
+        :param latency_factor: a request with latency above latency_factor times the lowest latency seen so far is a
+            latency spike
+        """
+        self.condition = threading.Condition()
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        # lowest latency seen so far: approximation of the latency of an unloaded server
+        self.base_latency = None
+        # successful requests since the last increase
+        self.successes = 0
+        # incremented with every decrease. Requests started before the last decrease can't trigger another decrease:
+        # only one decrease per congestion event
+        self.epoch = 0
+
+    def acquire(self):
+        """
+        Wait until the number of in-flight requests is below the limit
+        :return: token to be passed to release()
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            return self.epoch
+
+    def set_limit(self, limit, reason):
+        limit = max(self.minimum, min(self.maximum, limit))
+        if limit != self.limit:
+            log.info(f'AIMD: limit {self.limit} -> {limit} ({reason})')
+            self.limit = limit
+
+    def decrease_limit(self, token, reason):
+        # needs to be called with the condition held
+        if token == self.epoch:
+            self.epoch += 1
+            self.successes = 0
+            self.set_limit(math.floor(self.limit * self.decrease), reason)
+
+    def throttled(self, token):
+        """
+        A request failed due to overload (e.g. 429 or 5xx) and is retried; the request is still in flight
+        :param token: token returned by acquire()
+        """
+        with self.condition:
+            self.decrease_limit(token, 'retry')
+
+    def release(self, token, latency, ok):
+        """
+        Request completed
+        :param token: token returned by acquire()
+        :param latency: latency of the request in seconds; None: no latency sample, e.g. the page was served from
+            cache or the request was retried
+        :param ok: False if the request failed due to overload
+        """
+        with self.condition:
+            self.in_flight -= 1
+            if not ok:
+                self.decrease_limit(token, 'error')
+            elif latency is not None:
+                if self.base_latency is None or latency < self.base_latency:
+                    self.base_latency = latency
+                if latency > self.latency_factor * self.base_latency:
+                    self.decrease_limit(token, f'latency {latency * 1000:.1f}ms')
+                else:
+                    # additive increase: +1 per "round trip", i.e. after limit successful requests
+                    self.successes += 1
+                    if self.successes >= self.limit:
+                        self.successes = 0
+                        self.set_limit(self.limit + 1, f'latency {latency * 1000:.1f}ms')
+            self.condition.notify_all()
+
+
+def get_field_notices_adaptive(urls, limiter=None, cache=None, retry=None, rate_limiter=None):
+    """
+    Retrieve all field notices using ThreadPoolExecutor. The number of concurrent requests is adjusted by an AIMD
+    limiter based on latency and errors
+    :param urls:  list of field notice URLs
+    :param limiter: AIMDLimiter; default: AIMDLimiter()
+    :param cache: optional PageCache
+    :param retry: optional RetryPolicy
+    :param rate_limiter: optional HostRateLimiter
+    :return: list of field notice pages; None for pages which could not be retrieved
+    """
+    start = time.perf_counter()
+    limiter = limiter or AIMDLimiter()
+    results = [None] * len(urls)
+    session = make_session(pool_size=limiter.maximum)
+
+    def fetch(url, token):
+        request_start = time.perf_counter()
+        ok = True
+        # cache hits and retried requests are no latency samples
+        events = []
+
+        def report(kind):
+            events.append(kind)
+            if kind == 'retry':
+                limiter.throttled(token)
+
+        try:
+            return get_page(url, session=session, cache=cache, retry=retry, rate_limiter=rate_limiter, report=report)
+        except requests.HTTPError as e:
+            ok = e.response.status_code != 429 and e.response.status_code < 500
+            raise
+        except requests.RequestException:
+            ok = False
+            raise
+        finally:
+            limiter.release(token, None if events else time.perf_counter() - request_start, ok)
+
+    with session, concurrent.futures.ThreadPoolExecutor(max_workers=limiter.maximum) as executor:
+        # only submit a new task if the limiter allows for another request
+        future_map = {executor.submit(fetch, url, limiter.acquire()): i for i, url in enumerate(urls)}
+        for completed_future in concurrent.futures.as_completed(future_map):
+            i = future_map[completed_future]
+            try:
+                results[i] = completed_future.result()
+            except Exception as e:
+                log.error(f'Getting {urls[i]} failed: {e}')
+            else:
+                log.info(f'url {i} \'{urls[i]}\': {len(results[i])} bytes')
+    log.info(f'Adaptive: got {len(urls)} field notices in {(time.perf_counter() - start) * 1000:.3f}ms, '
+             f'final limit {limiter.limit}')
+    log_crawl_stats('Adaptive', cache, retry, rate_limiter)
+    return results
+
+
+async def get_page_async(session, url, semaphore, timeout, cache=None):
+    """
+    Asynchronously GET the page via given URL and return markup
+    :param session: aiohttp client session
+    :param url: URL to access
+    :param semaphore: semaphore limiting the number of concurrent requests
+    :param timeout: timeout in seconds for this request
+    :param cache: optional PageCache
+    :return: markup of retrieved web page
+    """
+    async with semaphore:
+        start = time.perf_counter()
+        cached = cache and cache.lookup(url)
+        if cached and cached.expires > time.time():
+            cache.count('hit')
+            log.info(f'got page for {url} from cache, {(time.perf_counter() - start) * 1000:.3f}ms')
+            return cached.body
+        log.info(f'GET on {url}')
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=timeout),
+                               headers=cached and cache.request_headers(cached)) as r:
+            if cached and r.status == 304:
+                cache.count('revalidated')
+                cache.refresh(url, r.headers)
+                log.info(f'got page for {url}, not modified, {(time.perf_counter() - start) * 1000:.3f}ms')
+                return cached.body
+            r.raise_for_status()
+            text = await r.text()
+            if cache:
+                cache.count('miss')
+                cache.store(url, text, r.headers)
+        log.info(f'got page for {url}, {(time.perf_counter() - start) * 1000:.3f}ms')
+    return text
+
+
+async def get_field_notices_async(urls, max_concurrency, timeout, cache=None):
+    """
+    Coroutine doing the actual work for get_field_notices_asyncio()
+    """
+
+    async def get_indexed_page(i, url):
+        # as_completed() doesn't tell us which task completed, hence we return the index together with the result
+        try:
+            return i, await get_page_async(session, url, semaphore, timeout, cache=cache)
+        except Exception as e:
+            return i, e
+
+    semaphore = asyncio.BoundedSemaphore(max_concurrency)
+    connector = aiohttp.TCPConnector(limit=max_concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        tasks = [get_indexed_page(i, url) for i, url in enumerate(urls)]
+        for completed_task in asyncio.as_completed(tasks):
+            i, r = await completed_task
+            if isinstance(r, Exception):
+                log.error(f'Getting {urls[i]} failed: {r!r}')
+            else:
+                log.info(f'url {i} \'{urls[i]}\': {len(r)} bytes')
+
+
+def get_field_notices_asyncio(urls, max_concurrency=100, timeout=30, cache=None):
+    """
+    Retrieve all field notices using asyncio in a single thread. The number of concurrent requests is limited by a
+    semaphore
+    :param urls:  list of field notice URLs
+    :param max_concurrency: max number of concurrent requests
+    :param timeout: timeout in seconds for each request
+    :param cache: optional PageCache
+    :return: None
+    """
+    start = time.perf_counter()
+    asyncio.run(get_field_notices_async(urls, max_concurrency=max_concurrency, timeout=timeout, cache=cache))
+    log.info(f'Asyncio: got {len(urls)} field notices in {(time.perf_counter() - start) * 1000:.3f}ms')
+    log_crawl_stats('Asyncio', cache)
+
+
+class StageStats:
+    """
+    Thread safe statistics of one pipeline stage
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.items = 0
+        self.busy = 0.0
+        self.first = None
+        self.last = None
+
+    def record(self, start, end):
+        """
+        Record processing of one item
+        :param start: perf_counter() at start of processing
+        :param end: perf_counter() at end of processing
+        """
+        with self.lock:
+            self.items += 1
+            self.busy += end - start
+            self.first = start if self.first is None else min(self.first, start)
+            self.last = end if self.last is None else max(self.last, end)
+
+    def log_summary(self):
+        elapsed = (self.last - self.first) if self.items else 0.0
+        throughput = self.items / elapsed if elapsed else 0.0
+        # utilization: share of the stage's wall time its workers were actually busy. The bottleneck stage is the one
+        # running close to 100% while the other stages wait for it
+        utilization = self.busy / (elapsed * self.workers) if elapsed else 0.0
+        log.info(f'stage {self.name:>7}: {self.workers:3} workers, {self.items:5} items in {elapsed * 1000:10.3f}ms, '
+                 f'{throughput:8.1f} items/s, {utilization:6.1%} busy')
+
+
+def iter_field_notice_urls(base_url=FN_BASE_PAGE, session=None):
+    """
+    Stream the field notice summary page and yield field notices as soon as the respective <li> is parsed
+    :param base_url: URL of the field notice summary page
+    :param session: session to use
+    :return: generator of FieldNotice tuples
+    """
+    if session is None:
+        with requests.Session() as session:
+            yield from iter_field_notice_urls(base_url=base_url, session=session)
+        return
+    log.info(f'GET on {base_url} (streaming)')
+    with session.get(url=base_url, stream=True) as r:
+        r.raise_for_status()
+        yield from iter_field_notices_from_chunks(r.iter_content(chunk_size=16384), base_url=base_url)
+
+
+def iter_field_notices_from_chunks(chunks, base_url=FN_BASE_PAGE):
+    """
+    Incrementally parse the field notice summary page and yield field notices as soon as the respective <li> is parsed
+    :param chunks: iterable of chunks of the markup
+    :param base_url: URL of the field notice summary page; used to determine full URLs
+    :return: generator of FieldNotice tuples
+    """
+    # same condition as in get_field_notice_urls(): <li> with a first <span> of class most_recent_link_title
+    parser = lxml.etree.HTMLPullParser(events=('end',), tag='li')
+    for chunk in itertools.chain(chunks, [None]):
+        if chunk is None:
+            parser.close()
+        else:
+            parser.feed(chunk)
+        for _, li in parser.read_events():
+            span = li.find('.//span')
+            a = li.find('.//a')
+            if span is not None and a is not None and \
+                    (span.get('class') or '').split()[:1] == ['most_recent_link_title']:
+                date = next((span for span in li.iter('span')
+                             if 'most_recent_link_date' in (span.get('class') or '').split()), None)
+                yield FieldNotice(url=urljoin(base_url, a.get('href')),
+                                  updated=parse_fn_date(date is not None and date.xpath('string()')))
+
+
+def parse_field_notice(markup):
+    """
+    Extract title, date and body text of a field notice
+    :param markup: markup of field notice page
+    :return: dict with title, date and body
+    """
+    soup = BeautifulSoup(markup=markup, features='lxml')
+    title = soup.h1 or soup.title
+    body = soup.body.get_text(separator='\n', strip=True) if soup.body else ''
+    date = FN_DATE.search(body)
+    return {'title': title.get_text(strip=True) if title else None,
+            'date': date and date.group(0),
+            'body': body}
+
+
+def get_field_notices_pipeline(base_url=FN_BASE_PAGE, fetch_workers=10, parse_workers=2, queue_size=100, cache=None,
+                               retry=None, rate_limiter=None):
+    """
+    Retrieve and parse all field notices in a pipeline of three stages connected by bounded queues:
+    extract URLs from the summary page -> fetch field notices -> parse field notices.
+    Fetching starts as soon as the first URL has been extracted from the summary page.
+    :param base_url: URL of the field notice summary page
+    :param fetch_workers: number of threads fetching field notices
+    :param parse_workers: number of threads parsing field notices
+    :param queue_size: max number of items waiting between two stages
+    :param cache: optional PageCache
+    :param retry: optional RetryPolicy
+    :param rate_limiter: optional HostRateLimiter
+    :return: list of dicts with url, title, date and body of each field notice
+    """
+    start = time.perf_counter()
+    url_queue = queue.Queue(maxsize=queue_size)
+    page_queue = queue.Queue(maxsize=queue_size)
+    extract_stats = StageStats('extract', 1)
+    fetch_stats = StageStats('fetch', fetch_workers)
+    parse_stats = StageStats('parse', parse_workers)
+    notices = []
+    notices_lock = threading.Lock()
+    session = make_session(pool_size=fetch_workers)
+
+    def extract():
+        try:
+            field_notices = iter_field_notice_urls(base_url=base_url)
+            while True:
+                item_start = time.perf_counter()
+                notice = next(field_notices, None)
+                if notice is None:
+                    break
+                extract_stats.record(item_start, time.perf_counter())
+                url_queue.put(notice.url)
+        finally:
+            # one sentinel per fetch worker
+            for _ in range(fetch_workers):
+                url_queue.put(None)
+
+    def fetch():
+        while (url := url_queue.get()) is not None:
+            item_start = time.perf_counter()
+            try:
+                page = get_page(url, session=session, cache=cache, retry=retry, rate_limiter=rate_limiter)
+            except Exception as e:
+                log.error(f'Getting {url} failed: {e}')
+                continue
+            fetch_stats.record(item_start, time.perf_counter())
+            page_queue.put((url, page))
+
+    def parse():
+        while (item := page_queue.get()) is not None:
+            item_start = time.perf_counter()
+            url, page = item
+            notice = parse_field_notice(page)
+            notice['url'] = url
+            parse_stats.record(item_start, time.perf_counter())
+            log.info(f'parsed \'{url}\': {notice["date"]}, {notice["title"]}')
+            with notices_lock:
+                notices.append(notice)
+
+    extractor = threading.Thread(target=extract, name='Extract')
+    fetchers = [threading.Thread(target=fetch, name=f'Fetch-{n}') for n in range(fetch_workers)]
+    parsers = [threading.Thread(target=parse, name=f'Parse-{n}') for n in range(parse_workers)]
+    [t.start() for t in itertools.chain([extractor], fetchers, parsers)]
+    extractor.join()
+    [t.join() for t in fetchers]
+    # all pages are fetched: tell the parsers to stop
+    for _ in range(parse_workers):
+        page_queue.put(None)
+    [t.join() for t in parsers]
+    session.close()
+
+    log.info(f'Pipeline: got {len(notices)} field notices in {(time.perf_counter() - start) * 1000:.3f}ms')
+    for stats in (extract_stats, fetch_stats, parse_stats):
+        stats.log_summary()
+    log_crawl_stats('Pipeline', cache, retry, rate_limiter)
+    return notices
+
+
+class MockFieldNoticeHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Request handler of the mock field notice server. Serves the summary page and the individual field notices
+    """
+    # HTTP/1.1 so that clients can keep connections alive
+    protocol_version = 'HTTP/1.1'
+    # headers and body are sent in separate writes: w/o TCP_NODELAY keep-alive connections run into delayed ACKs
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # every new connection means a new TCP handshake on the client side
+        self.server.count('connections')
+
+    def log_message(self, format, *args):
+        # keep the log clean
+        pass
+
+    def send_markup(self, markup, status=200, headers=None):
+        body = markup.encode()
+        self.server.count('bytes', len(body))
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.count('requests')
+        in_flight = self.server.enter()
+        try:
+            self.get(in_flight)
+        finally:
+            self.server.leave()
+
+    def get(self, in_flight):
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            # transient failure
+            self.server.count('errors')
+            self.send_markup('<html><body>Service unavailable</body></html>', status=503)
+            return
+        capacity = self.server.capacity
+        if capacity and in_flight > 2 * capacity:
+            # heavily overloaded: reject the request
+            self.server.count('rejected')
+            self.send_markup('<html><body>Too many requests</body></html>', status=429,
+                             headers={'Retry-After': '1'})
+            return
+        if self.server.latency:
+            # beyond capacity requests queue up and latency grows with the load
+            time.sleep(self.server.latency * (max(1.0, in_flight / capacity) if capacity else 1.0))
+        path = urlsplit(self.path).path
+        if path == self.server.summary_path:
+            self.send_markup(self.server.summary_page())
+            return
+        notice = self.server.notice_page(path)
+        if notice is None:
+            self.send_markup('<html><body>Not found</body></html>', status=404)
+            return
+        etag = f'"{hashlib.sha1(notice.encode()).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.server.count('not_modified')
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_markup(notice, headers={'ETag': etag, 'Last-Modified': self.server.last_modified})
+
+
+class MockFieldNoticeServer(http.server.ThreadingHTTPServer):
+    """
+    Local stand-in for the Cisco field notice site. Used to benchmark the different crawler modes without hitting
+    www.cisco.com. Use as context manager: the server is started in a background thread on a free port.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, notices=100, latency=0.0, notice_size=20000, capacity=None, error_rate=0.0):
+        """
+        :param notices: number of field notices linked from the summary page
+        :param latency: artificial latency (in seconds) added to each response
+        :param notice_size: approximate size of each field notice page in bytes
+        :param capacity: number of concurrent requests the server can handle w/o additional latency. Latency grows
+            linearly beyond capacity and requests are rejected with 429 above twice the capacity. None: unlimited
+        :param error_rate: share of requests failing with 503
+        """
+        super().__init__(('127.0.0.1', 0), MockFieldNoticeHandler)
+        # date of last update of each field notice
+        self.updated = [datetime.date(2020, 6, 30)] * notices
+        self.latency = latency
+        self.notice_size = notice_size
+        self.summary_path = urlsplit(FN_BASE_PAGE).path
+        self.counters_lock = threading.Lock()
+        self.counters = {}
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.in_flight = 0
+        self.last_modified = email.utils.formatdate(usegmt=True)
+        self.thread = None
 
-    urls = get_field_notice_urls()
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{self.summary_path}'
 
-    get_field_notices_sync(urls[:10])
+    def count(self, counter, increment=1):
+        with self.counters_lock:
+            self.counters[counter] = self.counters.get(counter, 0) + increment
 
+    def enter(self):
+        """
+        Start of request processing
+        :return: number of requests currently being processed
+        """
+        with self.counters_lock:
+            self.in_flight += 1
+            return self.in_flight
+
+    def leave(self):
+        with self.counters_lock:
+            self.in_flight -= 1
+
+    def reset_counters(self):
+        with self.counters_lock:
+            counters = self.counters
+            self.counters = {}
+        return counters
+
+    def update_notice(self, i, updated=None):
+        """
+        Simulate an update of a field notice
+        :param i: index of field notice
+        :param updated: date of the update; today if None
+        """
+        self.updated[i] = updated or datetime.date.today()
+
+    def add_notices(self, count):
+        """
+        Simulate publication of new field notices
+        :param count: number of new field notices
+        """
+        self.updated.extend([datetime.date.today()] * count)
+
+    @staticmethod
+    def notice_path(fn_id):
+        return f'/c/en/us/support/docs/field-notices/{fn_id // 100}/fn{fn_id}.html'
+
+    def summary_page(self):
+        entries = '\n'.join(f'<li><a href="{self.notice_path(63000 + i)}"><span class=\'most_recent_link_title\'>'
+                            f'Field Notice: FN - {63000 + i} - Mock field notice {i}</span></a>\n'
+                            f'<span class="most_recent_link_date">Updated&nbsp;{updated:%d-%b-%Y}</span><br /></li>'
+                            for i, updated in enumerate(self.updated))
+        return f'<html><body><ul class="doc-sublist">\n{entries}\n</ul></body></html>'
+
+    def notice_page(self, path):
+        fn_id = re.search(r'/fn(\d+)\.html$', path)
+        if fn_id is None:
+            return None
+        fn_id = int(fn_id.group(1))
+        i = fn_id - 63000
+        if not 0 <= i < len(self.updated) or path != self.notice_path(fn_id):
+            return None
+        filler = '<p>Lorem ipsum dolor sit amet.</p>\n' * (self.notice_size // 35)
+        return (f'<html><head><title>Field Notice: FN - {fn_id} - Mock field notice {i}</title></head>'
+                f'<body><h1>Field Notice: FN - {fn_id} - Mock field notice {i}</h1>'
+                f'<p>Revision 1.0, {self.updated[i]:%d-%b-%Y}</p>{filler}</body></html>')
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='MockServer', daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.thread.join()
+        super().__exit__(*args)
+
+
+def benchmark_sessions(notices=100, latency=0.01, max_workers=10):
+    """
+    Compare a new session per request (get_field_notices_futures) with the pooled variants using a local mock server.
+    :param notices: number of field notices to fetch
+    :param latency: artificial server latency in seconds
+    :param max_workers: number of worker threads (and connection pool size)
+    :return: None
+    """
+    modes = [('per call session', get_field_notices_futures),
+             ('shared session', lambda urls: get_field_notices_pooled(urls, max_workers=max_workers)),
+             ('per thread session', lambda urls: get_field_notices_pooled(urls, max_workers=max_workers,
+                                                                          per_thread_session=True))]
+    results = []
+    with MockFieldNoticeServer(notices=notices, latency=latency) as server:
+        urls = [notice.url for notice in get_field_notice_urls(base_url=server.base_url)]
+        for name, crawl in modes:
+            log.info('=' * 100)
+            server.reset_counters()
+            start = time.perf_counter()
+            crawl(urls)
+            elapsed = time.perf_counter() - start
+            counters = server.reset_counters()
+            results.append((name, elapsed, counters.get('connections', 0), counters.get('requests', 0)))
+    log.info('=' * 100)
+    for name, elapsed, connections, requests_served in results:
+        log.info(f'{name:>20}: {elapsed * 1000:10.3f}ms, {connections} connections for {requests_served} requests, '
+                 f'{connections / max(requests_served, 1):.3f} handshakes per fetch')
+
+
+def benchmark_engines(notices=100, latency=0.1, max_workers=10, max_concurrency=100):
+    """
+    Compare the sync, threaded, futures and asyncio modes using a local mock server with artificial latency
+    :param notices: number of field notices to fetch
+    :param latency: artificial server latency in seconds
+    :param max_workers: number of worker threads for the threaded and futures modes
+    :param max_concurrency: max number of concurrent requests for the asyncio mode
+    :return: None
+    """
+    modes = [('sync', get_field_notices_sync),
+             ('threaded', lambda urls: get_field_notices_threaded(urls, max_workers=max_workers)),
+             ('futures', get_field_notices_futures),
+             ('asyncio', lambda urls: get_field_notices_asyncio(urls, max_concurrency=max_concurrency))]
+    results = []
+    with MockFieldNoticeServer(notices=notices, latency=latency) as server:
+        urls = [notice.url for notice in get_field_notice_urls(base_url=server.base_url)]
+        for name, crawl in modes:
+            log.info('=' * 100)
+            start = time.perf_counter()
+            crawl(urls)
+            results.append((name, time.perf_counter() - start))
+    log.info('=' * 100)
+    for name, elapsed in results:
+        log.info(f'{name:>10}: {elapsed * 1000:10.3f}ms, {len(urls) / elapsed:8.1f} field notices/s')
+
+
+def benchmark_pipeline(notices=100, latency=0.1, fetch_workers=10, parse_workers=2):
+    """
+    Run the streaming pipeline against a local mock server and report the throughput of each stage
+    :param notices: number of field notices served by the mock server
+    :param latency: artificial server latency in seconds
+    :param fetch_workers: number of threads fetching field notices
+    :param parse_workers: number of threads parsing field notices
+    :return: None
+    """
+    with MockFieldNoticeServer(notices=notices, latency=latency) as server:
+        get_field_notices_pipeline(base_url=server.base_url, fetch_workers=fetch_workers,
+                                   parse_workers=parse_workers)
+
+
+def benchmark_cache(notices=100, latency=0.01, max_workers=10, cache_dir=None):
+    """
+    Crawl the local mock server three times: without cache, with a cold cache and with a warm cache
+    :param notices: number of field notices served by the mock server
+    :param latency: artificial server latency in seconds
+    :param max_workers: number of worker threads
+    :param cache_dir: cache directory; a temporary directory if None
+    :return: None
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            MockFieldNoticeServer(notices=notices, latency=latency) as server, \
+            PageCache(cache_dir or tmp_dir) as cache:
+        urls = [notice.url for notice in get_field_notice_urls(base_url=server.base_url)]
+        results = []
+        for name, crawl_cache in (('no cache', None), ('cold cache', cache), ('warm cache', cache)):
+            log.info('=' * 100)
+            server.reset_counters()
+            start = time.perf_counter()
+            get_field_notices_pooled(urls, max_workers=max_workers, cache=crawl_cache)
+            results.append((name, time.perf_counter() - start, server.reset_counters()))
+    log.info('=' * 100)
+    for name, elapsed, counters in results:
+        log.info(f'{name:>10}: {elapsed * 1000:10.3f}ms, {counters.get("bytes", 0) / 2 ** 20:6.2f}MiB sent, '
+                 f'{counters.get("not_modified", 0)} not modified')
+
+
+def benchmark_delta(notices=100, latency=0.01, max_workers=10, updated=3, new=2):
+    """
+    Compare a full crawl with an incremental crawl after some field notices have been updated or added
+    :param notices: number of field notices served by the mock server
+    :param latency: artificial server latency in seconds
+    :param max_workers: number of worker threads
+    :param updated: number of field notices to update before the 2nd crawl
+    :param new: number of field notices to add before the 2nd crawl
+    :return: None
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            MockFieldNoticeServer(notices=notices, latency=latency) as server:
+        state_file = os.path.join(tmp_dir, 'state.json')
+        for name in ('full crawl', 'delta crawl'):
+            log.info('=' * 100)
+            server.reset_counters()
+            start = time.perf_counter()
+            pages = get_field_notices_delta(get_field_notice_urls(base_url=server.base_url), state_file=state_file,
+                                            max_workers=max_workers)
+            results.append((name, time.perf_counter() - start, len(pages), server.reset_counters()))
+            for i in random.sample(range(len(server.updated)), updated):
+                server.update_notice(i)
+            server.add_notices(new)
+    log.info('=' * 100)
+    for name, elapsed, fetched, counters in results:
+        log.info(f'{name:>11}: {elapsed * 1000:10.3f}ms, {fetched} field notices retrieved, '
+                 f'{counters.get("requests", 0)} requests')
+
+
+def benchmark_parse(notices=2000, repeat=5):
+    """
+    Micro-benchmark: extract field notices from a summary page using BeautifulSoup vs. compiled XPath expressions.
+    Both parsers and the incremental parser of the streaming pipeline are checked to return identical results for the
+    saved fixture page and a generated summary page
+    :param notices: number of field notices on the generated summary page
+    :param repeat: number of runs per parser; the best run is reported
+    :return: None
+    """
+    with open(FN_FIXTURE, encoding='utf-8') as f:
+        fixture = f.read()
+    with MockFieldNoticeServer(notices=notices) as server:
+        generated = server.summary_page()
+    results = []
+    # keep the log clean while benchmarking
+    level = log.level
+    log.setLevel(logging.WARNING)
+    try:
+        for name, page in (('fixture', fixture), (f'{notices} notices', generated)):
+            soup_result = parse_field_notice_urls_soup(page)
+            lxml_result = parse_field_notice_urls_lxml(page)
+            if soup_result != lxml_result:
+                raise AssertionError(f'{name}: parsers disagree')
+            if list(iter_field_notices_from_chunks([page])) != lxml_result:
+                raise AssertionError(f'{name}: streaming parser disagrees')
+            timings = []
+            for parser in (parse_field_notice_urls_soup, parse_field_notice_urls_lxml):
+                runs = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    parser(page)
+                    runs.append(time.perf_counter() - start)
+                timings.append(min(runs))
+            results.append((name, len(lxml_result), *timings))
+    finally:
+        log.setLevel(level)
+    for name, found, soup_time, lxml_time in results:
+        log.info(f'{name}: {found} field notices, soup {soup_time * 1000:.3f}ms, lxml {lxml_time * 1000:.3f}ms, '
+                 f'speedup {soup_time / lxml_time:.1f}x')
+
+
+def benchmark_adaptive(notices=500, latency=0.05, capacity=20):
+    """
+    Compare fixed concurrency below and above server capacity with the adaptive limiter using a mock server which
+    simulates limited capacity
+    :param notices: number of field notices served by the mock server
+    :param latency: artificial latency of the unloaded server in seconds
+    :param capacity: number of concurrent requests the mock server handles w/o additional latency
+    :return: None
+    """
+    limiters = [(f'fixed {capacity // 2}',
+                 lambda: AIMDLimiter(initial=capacity // 2, minimum=capacity // 2, maximum=capacity // 2)),
+                (f'fixed {capacity * 3}',
+                 lambda: AIMDLimiter(initial=capacity * 3, minimum=capacity * 3, maximum=capacity * 3)),
+                ('adaptive', lambda: AIMDLimiter(maximum=capacity * 3))]
+    results = []
+    with MockFieldNoticeServer(notices=notices, latency=latency, capacity=capacity) as server:
+        urls = [notice.url for notice in get_field_notice_urls(base_url=server.base_url)]
+        for name, limiter in limiters:
+            log.info('=' * 100)
+            server.reset_counters()
+            start = time.perf_counter()
+            pages = get_field_notices_adaptive(urls, limiter=limiter())
+            results.append((name, time.perf_counter() - start, sum(p is not None for p in pages),
+                            server.reset_counters()))
+    log.info('=' * 100)
+    for name, elapsed, retrieved, counters in results:
+        log.info(f'{name:>10}: {elapsed * 1000:10.3f}ms, {retrieved / elapsed:7.1f} field notices/s, '
+                 f'{retrieved} retrieved, {counters.get("rejected", 0)} rejected')
+
+
+def benchmark_retry(notices=100, latency=0.01, max_workers=10, error_rate=0.1, rate=200.0):
+    """
+    Crawl a mock server with transient errors with and w/o retries and with a per host rate limit
+    :param notices: number of field notices served by the mock server
+    :param latency: artificial server latency in seconds
+    :param max_workers: number of worker threads
+    :param error_rate: share of requests failing with 503
+    :param rate: rate limit in requests per second
+    :return: None
+    """
+    modes = [('no retry', None, None),
+             ('retry', RetryPolicy(backoff=0.05), None),
+             (f'retry, {rate:.0f}/s', RetryPolicy(backoff=0.05), HostRateLimiter(rate=rate, burst=max_workers))]
+    results = []
+    with MockFieldNoticeServer(notices=notices, latency=latency, error_rate=error_rate) as server:
+        # don't let the summary page fail
+        summary_retry = RetryPolicy()
+        urls = [notice.url for notice in get_field_notice_urls(base_url=server.base_url, retry=summary_retry)]
+        for name, retry, rate_limiter in modes:
+            log.info('=' * 100)
+            server.reset_counters()
+            start = time.perf_counter()
+            pages = get_field_notices_threaded(urls, max_workers=max_workers, retry=retry, rate_limiter=rate_limiter)
+            results.append((name, time.perf_counter() - start, sum(p is not None for p in pages),
+                            server.reset_counters()))
     log.info('=' * 100)
-    get_field_notices_threaded(urls)
+    for name, elapsed, retrieved, counters in results:
+        log.info(f'{name:>12}: {elapsed * 1000:10.3f}ms, {retrieved} of {len(urls)} retrieved, '
+                 f'{counters.get("requests", 0)} requests, {counters.get("errors", 0)} errors')
 
+
+def benchmark_store(notices=1000, latency=0.0, notice_size=100000):
+    """
+    Compare peak memory of the futures crawler keeping all pages in memory vs. streaming pages to a NoticeStore
+    :param notices: number of field notices served by the mock server
+    :param latency: artificial server latency in seconds
+    :param notice_size: approximate size of each field notice page in bytes
+    :return: None
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            MockFieldNoticeServer(notices=notices, latency=latency, notice_size=notice_size) as server:
+        urls = [notice.url for notice in get_field_notice_urls(base_url=server.base_url)]
+        with NoticeStore(os.path.join(tmp_dir, 'notices.gz')) as store:
+            for name, sink in (('in memory', None), ('store', store)):
+                log.info('=' * 100)
+                # tracing slows down the crawl but we are only interested in memory here
+                tracemalloc.start()
+                start = time.perf_counter()
+                get_field_notices_futures(urls, sink=sink)
+                elapsed = time.perf_counter() - start
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                results.append((name, elapsed, peak))
+            # random access to a single field notice
+            url = random.choice(urls)
+            start = time.perf_counter()
+            page = store.read(url)
+            read_time = time.perf_counter() - start
+            size = os.path.getsize(store.path)
     log.info('=' * 100)
-    get_field_notices_futures(urls)
+    for name, elapsed, peak in results:
+        log.info(f'{name:>9}: {elapsed * 1000:10.3f}ms, peak memory {peak / 2 ** 20:7.1f}MiB')
+    log.info(f'store size {size / 2 ** 20:.1f}MiB, reading {len(page)} bytes of \'{url}\' took '
+             f'{read_time * 1000:.3f}ms')
+
+
+# crawl modes of main(). Only the modes of the original example run by default: the other modes issue a lot more
+# (asyncio: up to --max-concurrency, adaptive: up to 100) concurrent requests
+CRAWL_MODES = ['sync', 'threaded', 'futures', 'pooled', 'asyncio', 'pipeline', 'adaptive']
+DEFAULT_CRAWL_MODES = ['sync', 'threaded', 'futures']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Retrieve Cisco field notices using different concurrency models')
+    parser.add_argument('--benchmark',
+                        choices=['sessions', 'engines', 'pipeline', 'cache', 'delta', 'parse', 'adaptive', 'retry',
+                                 'store'],
+                        help='run a benchmark against a local mock server instead of crawling www.cisco.com')
+    parser.add_argument('--notices', type=int, default=100, help='number of field notices served by the mock server')
+    parser.add_argument('--latency', type=float, default=0.01, help='artificial latency of the mock server (seconds)')
+    parser.add_argument('--modes', default=','.join(DEFAULT_CRAWL_MODES),
+                        help=f'comma separated list of crawl modes: {",".join(CRAWL_MODES)}; the default modes keep '
+                             f'the load on www.cisco.com moderate')
+    parser.add_argument('--max-workers', type=int, default=10, help='number of worker threads')
+    parser.add_argument('--max-concurrency', type=int, default=100,
+                        help='max number of concurrent requests in asyncio mode')
+    parser.add_argument('--capacity', type=int, default=20,
+                        help='number of concurrent requests the mock server handles w/o additional latency')
+    parser.add_argument('--retries', type=int, default=3, help='max number of retries per request')
+    parser.add_argument('--rate-limit', type=float, help='max number of requests per second per host')
+    parser.add_argument('--store', metavar='FILE', help='write field notices to a compressed store')
+    parser.add_argument('--log-mode', choices=LOG_MODES, default='sync', help='how log records are written')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='write a timeline of the futures crawl in Chrome trace format to this file')
+    parser.add_argument('--parse-workers', type=int, default=2, help='number of parser threads in pipeline mode')
+    parser.add_argument('--cache', metavar='DIR', help='cache field notices in given directory')
+    parser.add_argument('--cache-size', type=int, default=100, help='max size of the cache in MiB')
+    parser.add_argument('--delta', metavar='STATE_FILE',
+                        help='incremental crawl: only retrieve field notices new or updated since the last crawl')
+    args = parser.parse_args()
+    modes = args.modes.split(',')
+    unknown = set(modes) - set(CRAWL_MODES)
+    if unknown:
+        parser.error(f'unknown crawl modes: {",".join(sorted(unknown))}')
+
+    f = logging.Formatter('%(asctime)s [%(levelname)s] [%(threadName)s] %(name)s: %(message)s')
+    # queue and json: records are formatted and written by a listener thread, not by the logging threads
+    setup_logging(log, f, mode=args.log_mode)
+    log.setLevel(logging.INFO)
+
+    if args.benchmark == 'sessions':
+        benchmark_sessions(notices=args.notices, latency=args.latency, max_workers=args.max_workers)
+        return
+    if args.benchmark == 'engines':
+        benchmark_engines(notices=args.notices, latency=args.latency, max_workers=args.max_workers,
+                          max_concurrency=args.max_concurrency)
+        return
+    if args.benchmark == 'pipeline':
+        benchmark_pipeline(notices=args.notices, latency=args.latency, fetch_workers=args.max_workers,
+                           parse_workers=args.parse_workers)
+        return
+    if args.benchmark == 'cache':
+        benchmark_cache(notices=args.notices, latency=args.latency, max_workers=args.max_workers,
+                        cache_dir=args.cache)
+        return
+    if args.benchmark == 'delta':
+        benchmark_delta(notices=args.notices, latency=args.latency, max_workers=args.max_workers)
+        return
+    if args.benchmark == 'parse':
+        benchmark_parse(notices=args.notices)
+        return
+    if args.benchmark == 'adaptive':
+        benchmark_adaptive(notices=args.notices, latency=args.latency, capacity=args.capacity)
+        return
+    if args.benchmark == 'retry':
+        benchmark_retry(notices=args.notices, latency=args.latency, max_workers=args.max_workers,
+                        rate=args.rate_limit or 200.0)
+        return
+    if args.benchmark == 'store':
+        benchmark_store(notices=args.notices, latency=args.latency)
+        return
+
+    cache = args.cache and PageCache(args.cache, max_size=args.cache_size * 2 ** 20)
+    retry = RetryPolicy(retries=args.retries)
+    rate_limiter = args.rate_limit and HostRateLimiter(rate=args.rate_limit)
+
+    notices = get_field_notice_urls(retry=retry)
+    if args.delta:
+        get_field_notices_delta(notices, state_file=args.delta, max_workers=args.max_workers, cache=cache,
+                                retry=retry, rate_limiter=rate_limiter)
+        return
+    urls = [notice.url for notice in notices]
+
+    for mode in modes:
+        if mode != modes[0]:
+            log.info('=' * 100)
+        if mode == 'sync':
+            get_field_notices_sync(urls[:10], cache=cache, retry=retry, rate_limiter=rate_limiter)
+        elif mode == 'threaded':
+            get_field_notices_threaded(urls, max_workers=args.max_workers, cache=cache, retry=retry,
+                                       rate_limiter=rate_limiter)
+        elif mode == 'futures':
+            # the data and index files of the store are closed as soon as the crawl is done
+            with NoticeStore(args.store) if args.store else contextlib.nullcontext() as sink:
+                get_field_notices_futures(urls, cache=cache, retry=retry, rate_limiter=rate_limiter, sink=sink,
+                                          trace=args.trace)
+        elif mode == 'pooled':
+            get_field_notices_pooled(urls, max_workers=args.max_workers, cache=cache, retry=retry,
+                                     rate_limiter=rate_limiter)
+        elif mode == 'asyncio':
+            get_field_notices_asyncio(urls, max_concurrency=args.max_concurrency, cache=cache)
+        elif mode == 'pipeline':
+            get_field_notices_pipeline(fetch_workers=args.max_workers, parse_workers=args.parse_workers, cache=cache,
+                                       retry=retry, rate_limiter=rate_limiter)
+        elif mode == 'adaptive':
+            get_field_notices_adaptive(urls, cache=cache, retry=retry, rate_limiter=rate_limiter)
+
+
+if __name__ == '__main__':
+    main()
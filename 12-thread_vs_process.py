@@ -1,10 +1,29 @@
 #!/usr/bin/env python
 import logging
 import random
+import collections
+import sqlite3
+import tempfile
+import json
+import csv
+import statistics
+import platform
+import sys
+import atexit
 import math
+import os
 import itertools
 import time
+import argparse
+import contextlib
+import threading
+import pickle
 import concurrent.futures
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from instrumentation import InstrumentedExecutor, percentile
+from priority_executor import PriorityExecutor
 
 log = logging.getLogger(__name__)
 
@@ -26,57 +45,1661 @@ def generate_products(no_of_products):
     return products
 
 
-def trivial_factoring(n):
+class FactoringCancelled(Exception):
+    """
+    Raised by cancellable factoring when the job or the whole batch has been cancelled
+    """
+
+
+class FactoringTimeout(FactoringCancelled):
+    """
+    Raised by cancellable factoring when the deadline of a job has passed
+    """
+
+
+# number of trial divisions between two checks for cancellation
+CANCEL_CHECK_INTERVAL = 1 << 16
+
+
+def check_cancelled(deadline=None, cancel=None):
+    """
+    Raise an exception if a job has been cancelled or its deadline has passed
+    :param deadline: time.monotonic() value or None
+    :param cancel: threading.Event or multiprocessing.Event or None
+    """
+    if cancel is not None and cancel.is_set():
+        raise FactoringCancelled()
+    if deadline is not None and time.monotonic() > deadline:
+        raise FactoringTimeout()
+
+
+def trivial_factoring(n, deadline=None, cancel=None):
     """
     Trivial (and slow!) method to factorize a given number
     :param n: number to factorize
+    :param deadline: time.monotonic() value; FactoringTimeout is raised once the deadline has passed
+    :param cancel: threading.Event or multiprocessing.Event; FactoringCancelled is raised once the event is set
     :return: list of prime factors
     """
     o = n
     factors = []
-    for i in itertools.chain([2], range(3, math.ceil(math.sqrt(n)) + 1, 2)):
-        while not n % i:
-            n = n // i
-            factors.append(i)
+    limit = math.ceil(math.sqrt(n)) + 1
+    # candidates in blocks; check for cancellation between blocks
+    step = 2 * CANCEL_CHECK_INTERVAL
+    blocks = itertools.chain([[2]], (range(start, min(start + step, limit), 2) for start in range(3, limit, step)))
+    for block in blocks:
+        check_cancelled(deadline, cancel)
+        for i in block:
+            while not n % i:
+                n = n // i
+                factors.append(i)
+            if n == 1:
+                break
         if n == 1:
             break
     log.info(f'trivial_factoring({o}): {",".join(f"{n}" for n in factors)}')
     return factors
 
 
+def small_primes(limit):
+    """
+    Sieve of Eratosthenes
+    :param limit: upper bound (inclusive)
+    :return: list of all primes <= limit
+    """
+    sieve = bytearray([1]) * (limit + 1)
+    sieve[:2] = b'\x00\x00'
+    for i in range(2, math.isqrt(limit) + 1):
+        if sieve[i]:
+            sieve[i * i::i] = bytes(len(range(i * i, limit + 1, i)))
+    return [i for i, is_prime in enumerate(sieve) if is_prime]
+
+
+SMALL_PRIMES = small_primes(1000)
+
+# Miller-Rabin with these bases is deterministic for n < 3.3 * 10 ** 24
+MR_BASES = SMALL_PRIMES[:13]
+
+
+def is_probable_prime(n):
+    """
+    Miller-Rabin primality test. Deterministic for n < 3.3 * 10 ** 24, for larger n the error probability is below
+    4 ** -20
+    :param n: number to test
+    :return: True if n is (probably) prime
+    """
+    if n < 2:
+        return False
+    for p in MR_BASES:
+        if n % p == 0:
+            return n == p
+    d, s = n - 1, 0
+    while not d % 2:
+        d //= 2
+        s += 1
+    bases = MR_BASES if n < 3317044064679887385961981 else MR_BASES + [random.randrange(2, n - 1) for _ in range(7)]
+    for a in bases:
+        x = pow(a, d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def pollard_rho_brent(n, max_iterations=None):
+    """
+    Find a non-trivial factor of a composite number using Brent's variant of Pollard's rho algorithm
+    :param n: odd composite number
+    :param max_iterations: give up after this many iterations; None: don't give up
+    :return: non-trivial factor of n or None if no factor was found within max_iterations
+    """
+    iterations = 0
+    while True:
+        y, c, m = random.randrange(1, n), random.randrange(1, n), 128
+        g = r = q = 1
+        while g == 1:
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(m, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = math.gcd(q, n)
+                k += m
+            r *= 2
+            iterations += r
+            if max_iterations and iterations > max_iterations and g == 1:
+                return None
+        if g == n:
+            # the product of differences collapsed: backtrack one step at a time
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = math.gcd(abs(x - ys), n)
+        if g != n:
+            return g
+        # unlucky choice of c: try again
+
+
+class FactorFound(Exception):
+    """
+    Raised during ECM point arithmetic when a non-invertible denominator reveals a factor
+    """
+
+    def __init__(self, factor):
+        super().__init__(factor)
+        self.factor = factor
+
+
+def ec_add(p, q, a, n):
+    """
+    Add two points on the elliptic curve y^2 = x^3 + a * x + b over Z/nZ. None is the point at infinity
+    """
+    if p is None:
+        return q
+    if q is None:
+        return p
+    (x1, y1), (x2, y2) = p, q
+    if x1 == x2:
+        if (y1 + y2) % n == 0:
+            return None
+        num, den = 3 * x1 * x1 + a, 2 * y1
+    else:
+        num, den = y2 - y1, x2 - x1
+    try:
+        inv = pow(den, -1, n)
+    except ValueError:
+        raise FactorFound(math.gcd(den, n))
+    slope = num * inv % n
+    x3 = (slope * slope - x1 - x2) % n
+    return x3, (slope * (x1 - x3) - y1) % n
+
+
+def ec_multiply(k, p, a, n):
+    """
+    Multiply point p by k using double-and-add
+    """
+    result = None
+    while k:
+        if k & 1:
+            result = ec_add(result, p, a, n)
+        p = ec_add(p, p, a, n)
+        k >>= 1
+    return result
+
+
+ECM_B1 = 2000
+ECM_PRIME_POWERS = [p ** int(math.log(ECM_B1, p)) for p in small_primes(ECM_B1)]
+
+
+def ecm_factor(n, curves=200):
+    """
+    Lenstra elliptic curve method (stage 1 only) on random curves in Weierstrass form
+    :param n: composite number w/o small factors
+    :param curves: number of curves to try
+    :return: non-trivial factor of n or None if no factor was found
+    """
+    for _ in range(curves):
+        # random curve through a random point: b is implicitly defined by the point
+        x, y, a = (random.randrange(n) for _ in range(3))
+        point = (x, y)
+        try:
+            for prime_power in ECM_PRIME_POWERS:
+                point = ec_multiply(prime_power, point, a, n)
+                if point is None:
+                    break
+        except FactorFound as e:
+            if e.factor != n:
+                return e.factor
+    return None
+
+
+# cofactors with more bits than this are first attacked with ECM if ECM is enabled
+ECM_THRESHOLD_BITS = 100
+
+
+def split_factors(n, ecm=False):
+    """
+    Recursively split a number w/o small prime factors into its prime factors
+    :param n: number w/o prime factors in SMALL_PRIMES
+    :param ecm: try ECM before Pollard-rho for large cofactors
+    :return: list of prime factors (unsorted)
+    """
+    if n == 1:
+        return []
+    if is_probable_prime(n):
+        return [n]
+    # perfect powers are hard for Pollard-rho
+    root = math.isqrt(n)
+    if root * root == n:
+        return split_factors(root, ecm) * 2
+    factor = None
+    if ecm and n.bit_length() > ECM_THRESHOLD_BITS:
+        factor = pollard_rho_brent(n, max_iterations=100000) or ecm_factor(n)
+    if factor is None:
+        factor = pollard_rho_brent(n)
+    return split_factors(factor, ecm) + split_factors(n // factor, ecm)
+
+
+def rho_factoring(n, ecm=False):
+    """
+    Fast factorization: trial division by small primes, Miller-Rabin primality test and Pollard-rho (Brent)
+    :param n: number to factorize
+    :param ecm: use ECM for large cofactors
+    :return: list of prime factors
+    """
+    o = n
+    factors = []
+    for p in SMALL_PRIMES:
+        while not n % p:
+            n //= p
+            factors.append(p)
+    factors.extend(sorted(split_factors(n, ecm=ecm)))
+    log.info(f'{"ecm" if ecm else "rho"}_factoring({o}): {",".join(f"{n}" for n in factors)}')
+    return factors
+
+
+def ecm_factoring(n):
+    """
+    Same as rho_factoring() but with ECM stage for large cofactors
+    :param n: number to factorize
+    :return: list of prime factors
+    """
+    return rho_factoring(n, ecm=True)
+
+
+# default upper bound for the batch trial division. Large enough for products of PRIMES; larger remaining cofactors
+# are split using Pollard-rho
+BATCH_BOUND = 10 ** 8
+
+# cached table of primes used by batch_trial_division()
+_prime_table = np.array([], dtype=np.uint64)
+_prime_table_limit = 0
+_prime_table_lock = threading.Lock()
+
+
+def sieve_primes(limit):
+    """
+    Sieve of Eratosthenes on odd numbers using NumPy
+    :param limit: upper bound (inclusive)
+    :return: uint64 array of all primes <= limit
+    """
+    if limit < 2:
+        return np.array([], dtype=np.uint64)
+    # sieve[i] represents 2 * i + 1
+    sieve = np.ones((limit + 1) // 2, dtype=bool)
+    sieve[0] = False
+    for i in range(1, (math.isqrt(limit) - 1) // 2 + 1):
+        if sieve[i]:
+            p = 2 * i + 1
+            sieve[p * p // 2::p] = False
+    return np.concatenate(([2], 2 * np.flatnonzero(sieve) + 1)).astype(np.uint64)
+
+
+def prime_table(limit):
+    """
+    All primes up to limit. The table is computed once and cached; it is only extended if a larger limit is requested
+    :param limit: upper bound (inclusive)
+    :return: uint64 array of primes
+    """
+    global _prime_table, _prime_table_limit
+    with _prime_table_lock:
+        if limit > _prime_table_limit:
+            start = time.perf_counter()
+            _prime_table, _prime_table_limit = sieve_primes(limit), limit
+            log.info(f'sieving {len(_prime_table)} primes up to {limit} took '
+                     f'{(time.perf_counter() - start) * 1000:.3f}ms')
+        return _prime_table[:np.searchsorted(_prime_table, limit, side='right')]
+
+
+def residues_uint64(values, primes):
+    """
+    Remainders of numbers < 2 ** 63 divided by primes
+    :param values: list of numbers
+    :param primes: uint64 array of primes
+    :return: 2D array: one row of remainders per number
+    """
+    return np.array(values, dtype=np.uint64)[:, None] % primes[None, :]
+
+
+def residues_bigint(values, primes):
+    """
+    Remainders of arbitrarily large numbers divided by primes < 2 ** 31. Each number is split into 32 bit limbs and
+    the remainder is accumulated limb by limb (Horner's method) so that all intermediate values fit in 64 bits
+    :param values: list of numbers
+    :param primes: uint64 array of primes
+    :return: 2D array: one row of remainders per number
+    """
+    no_of_limbs = (max(values).bit_length() + 31) // 32
+    limbs = np.array([[(v >> (32 * (no_of_limbs - 1 - j))) & 0xffffffff for j in range(no_of_limbs)]
+                      for v in values], dtype=np.uint64)
+    base = np.uint64(1 << 32) % primes
+    remainders = np.zeros((len(values), len(primes)), dtype=np.uint64)
+    for j in range(no_of_limbs):
+        # remainder < p < 2 ** 31, base < 2 ** 31, limb < 2 ** 32: no overflow
+        remainders = (remainders * base + limbs[:, j:j + 1]) % primes
+    return remainders
+
+
+def trial_divide_block(rows, cofactors, factors, primes, residues, primes_per_chunk):
+    """
+    Trial division of a block of numbers by chunks of primes. Divides cofactors in place and appends found factors
+    :param rows: indices of the numbers in this block
+    :param cofactors: list of cofactors of all numbers
+    :param factors: list of factor lists of all numbers
+    :param primes: uint64 array of primes
+    :param residues: residues_uint64 or residues_bigint
+    :param primes_per_chunk: number of primes tested in one go
+    """
+    active = list(rows)
+    for start in range(0, len(primes), primes_per_chunk):
+        chunk = primes[start:start + primes_per_chunk]
+        # a cofactor w/o prime factors below p is prime if p ** 2 exceeds it
+        smallest = int(chunk[0])
+        active = [row for row in active if smallest * smallest <= cofactors[row]]
+        if not active:
+            break
+        hit_rows, hit_columns = np.nonzero(residues([cofactors[row] for row in active], chunk) == 0)
+        for i, j in zip(hit_rows.tolist(), hit_columns.tolist()):
+            row, p = active[i], int(chunk[j])
+            while not cofactors[row] % p:
+                cofactors[row] //= p
+                factors[row].append(p)
+
+
+def batch_trial_division(numbers, bound=None, numbers_per_chunk=64, primes_per_chunk=1 << 16):
+    """
+    Factorize a batch of numbers by trial division with a cached table of primes. Divisibility is tested with NumPy
+    for a block of numbers against a chunk of primes at a time. Numbers < 2 ** 63 are tested directly, larger numbers
+    via 32 bit limbs. Cofactors left after trial division up to bound are split using Pollard-rho
+    :param numbers: list of numbers to factorize
+    :param bound: largest prime to use for trial division; default: min(sqrt(max(numbers)), BATCH_BOUND)
+    :param numbers_per_chunk: number of numbers tested in one go
+    :param primes_per_chunk: number of primes tested in one go
+    :return: list of lists of prime factors; same order as numbers
+    """
+    if not numbers:
+        return []
+    bound = bound or min(math.isqrt(max(numbers)), BATCH_BOUND)
+    if bound >= 1 << 31:
+        raise ValueError('bound has to be below 2 ** 31')
+    primes = prime_table(bound)
+    cofactors = list(numbers)
+    factors = [[] for _ in numbers]
+    rows = [i for i, n in enumerate(numbers) if n > 1]
+    small = [i for i in rows if numbers[i] < 1 << 63]
+    big = [i for i in rows if numbers[i] >= 1 << 63]
+    for group, residues in ((small, residues_uint64), (big, residues_bigint)):
+        for start in range(0, len(group), numbers_per_chunk):
+            trial_divide_block(group[start:start + numbers_per_chunk], cofactors, factors, primes, residues,
+                               primes_per_chunk)
+    for row, cofactor in enumerate(cofactors):
+        if cofactor > 1:
+            # no prime factor <= bound left: if bound ** 2 exceeds the cofactor it is prime
+            factors[row].extend([cofactor] if cofactor <= bound * bound else split_factors(cofactor))
+            factors[row].sort()
+    return factors
+
+
+def sieve_factoring(n):
+    """
+    Factorize a single number using batch_trial_division()
+    :param n: number to factorize
+    :return: list of prime factors
+    """
+    factors = batch_trial_division([n])[0]
+    log.info(f'sieve_factoring({n}): {",".join(f"{n}" for n in factors)}')
+    return factors
+
+
+def benchmark_batch(no_of_products=1000, reference_products=5):
+    """
+    Compare the per number trivial_factoring() loop with batch_trial_division()
+    :param no_of_products: number of products to factorize in a batch
+    :param reference_products: number of products to factorize with trivial_factoring() (it's slow!)
+    :return: None
+    """
+    numbers = generate_products(no_of_products=no_of_products)
+
+    log.info('=' * 100)
+    start = time.perf_counter()
+    reference = [trivial_factoring(number) for number in numbers[:reference_products]]
+    trivial_time = time.perf_counter() - start
+
+    log.info('=' * 100)
+    start = time.perf_counter()
+    prime_table(BATCH_BOUND)
+    sieve_time = time.perf_counter() - start
+    start = time.perf_counter()
+    factors = batch_trial_division(numbers)
+    batch_time = time.perf_counter() - start
+    if factors[:reference_products] != reference:
+        raise AssertionError('trivial_factoring() and batch_trial_division() disagree')
+
+    log.info('=' * 100)
+    trivial_rate = len(reference) / trivial_time
+    batch_rate = len(numbers) / batch_time
+    log.info(f'  trivial: {len(reference)} products in {trivial_time * 1000:10.3f}ms, {trivial_rate:8.2f} numbers/s')
+    log.info(f'    batch: {len(numbers)} products in {batch_time * 1000:10.3f}ms, {batch_rate:8.2f} numbers/s, '
+             f'{batch_rate / trivial_rate:.1f}x (sieve: {sieve_time * 1000:.3f}ms)')
+
+
+class FactorCache:
+    """
+    Memoizing cache of prime factorizations. Least recently used entries are evicted once the cache holds more than
+    max_size numbers. Optionally factorizations are persisted in an SQLite database: the database can be shared by
+    multiple processes and survives across runs.
+    Besides full hits the cache supports partial reuse: all primes found so far are tried as divisors first and
+    cofactors found while splitting a number are looked up in the cache as well.
+    Counts hits (memory), disk hits (database), partial hits (at least one known prime or cached cofactor) and misses.
+    Thread-safe. Each process has its own in memory cache; use a database path to share results between processes.
+    """
+
+    def __init__(self, max_size=100000, path=None, max_primes=1024):
+        """
+        :param max_size: max number of cached factorizations in memory
+        :param path: path of the SQLite database; None: no persistence
+        :param max_primes: max number of known primes tried as divisors
+        """
+        self.max_size = max_size
+        self.path = path
+        self.max_primes = max_primes
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        # number -> tuple of prime factors; order is LRU order: least recently used first
+        self.entries = collections.OrderedDict()
+        # primes found so far; a dict keeps insertion order
+        self.primes = {}
+        # one database connection per thread and process
+        self.local = threading.local()
+        if path:
+            with self.connection() as db:
+                db.execute('CREATE TABLE IF NOT EXISTS factors (n TEXT PRIMARY KEY, factors TEXT NOT NULL)')
+
+    def connection(self):
+        """
+        Database connection of the current thread
+        :return: sqlite3.Connection
+        """
+        # connections must not be shared with forked worker processes
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.pid = os.getpid()
+            self.local.db = sqlite3.connect(self.path, timeout=30)
+            self.local.db.execute('PRAGMA journal_mode=WAL')
+            self.local.db.execute('PRAGMA synchronous=NORMAL')
+        return self.local.db
+
+    def lookup(self, n):
+        """
+        Get a cached factorization
+        :param n: number
+        :return: tuple of prime factors or None if n is not cached
+        """
+        with self.lock:
+            factors = self.entries.get(n)
+            if factors is not None:
+                self.entries.move_to_end(n)
+                return factors
+        if not self.path:
+            return None
+        row = self.connection().execute('SELECT factors FROM factors WHERE n = ?', (str(n),)).fetchone()
+        if row is None:
+            return None
+        factors = tuple(int(f) for f in row[0].split(','))
+        self.store(n, factors, persist=False)
+        return factors
+
+    def store(self, n, factors, persist=True):
+        """
+        Put a factorization into the cache and evict least recently used entries if the cache gets too large
+        :param n: number
+        :param factors: prime factors of n
+        :param persist: also write the factorization to the database
+        """
+        factors = tuple(factors)
+        with self.lock:
+            self.entries[n] = factors
+            self.entries.move_to_end(n)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            for p in factors:
+                if len(self.primes) >= self.max_primes:
+                    break
+                self.primes[p] = None
+        if persist and self.path:
+            with self.connection() as db:
+                db.execute('INSERT OR REPLACE INTO factors VALUES (?, ?)', (str(n), ','.join(map(str, factors))))
+
+    def count(self, kind):
+        with self.lock:
+            self.stats[kind] += 1
+
+    def split(self, n):
+        """
+        Like split_factors(), but cofactors are looked up in and added to the cache
+        :param n: number w/o prime factors in SMALL_PRIMES
+        :return: tuple: list of prime factors (unsorted), True if a cached cofactor was reused
+        """
+        if n == 1:
+            return [], False
+        cached = self.lookup(n)
+        if cached is not None:
+            return list(cached), True
+        if is_probable_prime(n):
+            return [n], False
+        # perfect powers are hard for Pollard-rho
+        root = math.isqrt(n)
+        if root * root == n:
+            left, left_reused = self.split(root)
+            right, right_reused = left, False
+        else:
+            factor = pollard_rho_brent(n)
+            left, left_reused = self.split(factor)
+            right, right_reused = self.split(n // factor)
+        factors = left + right
+        self.store(n, sorted(factors))
+        return factors, left_reused or right_reused
+
+    def factorize(self, n):
+        """
+        Factorize a number using cached results where possible
+        :param n: number to factorize
+        :return: list of prime factors
+        """
+        with self.lock:
+            in_memory = n in self.entries
+        cached = self.lookup(n)
+        if cached is not None:
+            self.count('hits' if in_memory else 'disk')
+            return list(cached)
+        o = n
+        factors = []
+        for p in SMALL_PRIMES:
+            while not n % p:
+                n //= p
+                factors.append(p)
+        with self.lock:
+            primes = list(self.primes)
+        reused = False
+        for p in primes:
+            while not n % p:
+                n //= p
+                factors.append(p)
+                reused = True
+        cofactors, cofactor_reused = self.split(n)
+        factors.extend(cofactors)
+        factors.sort()
+        self.count('partial' if reused or cofactor_reused else 'misses')
+        self.store(o, factors)
+        return factors
+
+    def log_stats(self, mode):
+        """
+        Log and reset hit/miss counts
+        :param mode: mode for the log message
+        """
+        with self.lock:
+            stats = dict(self.stats)
+            self.stats.clear()
+            size = len(self.entries)
+        total = sum(stats.values())
+        hits = stats.get('hits', 0) + stats.get('disk', 0)
+        log.info(f'{mode}: factor cache: {stats.get("hits", 0)} hits, {stats.get("disk", 0)} disk hits, '
+                 f'{stats.get("partial", 0)} partial hits, {stats.get("misses", 0)} misses, '
+                 f'hit rate {hits / (total or 1):.1%}, {size} entries')
+
+
+# process wide factor cache used by the cached engine; replaced in worker processes by init_factor_cache()
+FACTOR_CACHE = FactorCache()
+
+
+def init_factor_cache(max_size=100000, path=None, max_primes=1024, quiet=False):
+    """
+    Set up the process wide factor cache; also used as initializer of worker processes
+    :param max_size: max number of cached factorizations in memory
+    :param path: path of the SQLite database; None: no persistence
+    :param max_primes: max number of known primes tried as divisors
+    :param quiet: only log warnings and errors
+    """
+    global FACTOR_CACHE
+    FACTOR_CACHE = FactorCache(max_size=max_size, path=path, max_primes=max_primes)
+    if quiet:
+        quiet_worker()
+
+
+def cached_factoring(n):
+    """
+    Factorize a number using the process wide factor cache; misses are factorized using Pollard-rho
+    :param n: number to factorize
+    :return: list of prime factors
+    """
+    factors = FACTOR_CACHE.factorize(n)
+    log.info(f'cached_factoring({n}): {",".join(f"{n}" for n in factors)}')
+    return factors
+
+
+# available factoring engines. All engines take a number and return the sorted list of prime factors
+FACTORING_ENGINES = {'trivial': trivial_factoring,
+                     'rho': rho_factoring,
+                     'ecm': ecm_factoring,
+                     'sieve': sieve_factoring,
+                     'cached': cached_factoring}
+
+
+def benchmark_engines(engines, no_of_products=5):
+    """
+    Compare factoring engines on the same set of products
+    :param engines: names of engines to compare; the first engine is the reference
+    :param no_of_products: number of products to factorize
+    :return: None
+    """
+    numbers = generate_products(no_of_products=no_of_products)
+    results = []
+    reference = None
+    for engine in engines:
+        log.info('=' * 100)
+        factoring = FACTORING_ENGINES[engine]
+        start = time.perf_counter()
+        factors = [factoring(number) for number in numbers]
+        elapsed = time.perf_counter() - start
+        if reference is None:
+            reference = factors
+        elif factors != reference:
+            raise AssertionError(f'{engine} and {engines[0]} disagree')
+        results.append((engine, elapsed))
+    log.info('=' * 100)
+    for engine, elapsed in results:
+        log.info(f'{engine:>8}: factorizing {len(numbers)} products took {elapsed * 1000:10.3f}ms, '
+                 f'{results[0][1] / elapsed:10.1f}x')
+
+
+def benchmark_cache(no_of_products=2000, max_workers=None, duplicates=10, path=None):
+    """
+    Show the effect of the factor cache: cold and warm runs, duplicate heavy input and persistence across processes
+    :param no_of_products: number of products to factorize
+    :param max_workers: number of worker processes; default: number of CPUs
+    :param duplicates: every product appears that many times in the duplicate heavy input
+    :param path: path of the SQLite database for the process pool runs; default: temporary file
+    :return: None
+    """
+    max_workers = max_workers or os.cpu_count()
+    numbers = generate_products(no_of_products=no_of_products)
+    heavy = numbers[:max(1, no_of_products // duplicates)] * duplicates
+    random.shuffle(heavy)
+    level = log.level
+    results = []
+
+    def run(name, factoring, numbers):
+        log.setLevel(logging.WARNING)
+        try:
+            start = time.perf_counter()
+            factors = [factoring(number) for number in numbers]
+            elapsed = time.perf_counter() - start
+        finally:
+            log.setLevel(level)
+        results.append((name, len(numbers), elapsed))
+        return factors
+
+    reference = run('rho', rho_factoring, numbers)
+    init_factor_cache()
+    if run('cached, cold', cached_factoring, numbers) != reference:
+        raise AssertionError('cached and rho results disagree')
+    FACTOR_CACHE.log_stats('cached, cold')
+    run('cached, warm', cached_factoring, numbers)
+    FACTOR_CACHE.log_stats('cached, warm')
+    # small cache: only few primes known and LRU evictions
+    init_factor_cache(max_size=16, max_primes=2)
+    run('cached, 16 entries', cached_factoring, numbers)
+    FACTOR_CACHE.log_stats('cached, 16 entries')
+    run('rho, duplicates', rho_factoring, heavy)
+    init_factor_cache()
+    run('cached, duplicates', cached_factoring, heavy)
+    FACTOR_CACHE.log_stats('cached, duplicates')
+
+    # persistence: a 2nd process pool run is served from the database written by the 1st one
+    path = path or os.path.join(tempfile.gettempdir(), f'factor_cache_{os.getpid()}.sqlite')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    try:
+        for name in ('process pool, empty db', 'process pool, warm db'):
+            start = time.perf_counter()
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=init_factor_cache,
+                                                        initargs=(100000, path, 1024, True)) as executor:
+                factors = list(executor.map(factor_chunk, [numbers[i:i + 100] for i in range(0, len(numbers), 100)],
+                                            itertools.repeat('cached')))
+            results.append((name, len(numbers), time.perf_counter() - start))
+            if [f for _, _, _, chunk in factors for f in chunk] != reference:
+                raise AssertionError('process pool and rho results disagree')
+        rows = sqlite3.connect(path).execute('SELECT COUNT(*) FROM factors').fetchone()[0]
+        log.info(f'database {path}: {rows} factorizations')
+    finally:
+        init_factor_cache()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    log.info('=' * 100)
+    for name, count, elapsed in results:
+        log.info(f'{name:>24}: factorizing {count} products took {elapsed * 1000:10.3f}ms, '
+                 f'{results[0][2] / results[0][1] / (elapsed / count):8.1f}x')
+
+
+def quiet_worker():
+    """
+    Initializer for worker processes: only log warnings and errors
+    """
+    log.setLevel(logging.WARNING)
+
+
+def factor_chunk(numbers, engine):
+    """
+    Factorize a chunk of numbers in a worker process
+    :param numbers: list of numbers
+    :param engine: name of factoring engine
+    :return: tuple: worker pid, start and end time of processing, list of lists of prime factors
+    """
+    start = time.time()
+    factoring = FACTORING_ENGINES[engine]
+    factors = [factoring(number) for number in numbers]
+    return os.getpid(), start, time.time(), factors
+
+
+def guided_chunk_size(remaining, max_workers, min_chunk_size=1, chunks_per_worker=2):
+    """
+    Chunk size for guided self-scheduling
+    :param remaining: number of numbers not yet submitted
+    :param max_workers: number of worker processes
+    :param min_chunk_size: lower bound for the chunk size
+    :param chunks_per_worker: number of chunks per worker in flight
+    :return: size of the next chunk
+    """
+    return max(min_chunk_size, math.ceil(remaining / (chunks_per_worker * max_workers)))
+
+
+def factor_chunked(numbers, max_workers=None, engine='trivial', min_chunk_size=1, chunks_per_worker=2, quiet=False,
+                   pool=None):
+    """
+    Factorize numbers in a process pool submitting chunks of numbers instead of single numbers. Chunk sizes adapt to
+    the remaining work (guided self-scheduling): each chunk is 1 / (chunks_per_worker * max_workers) of the numbers
+    not yet submitted. Early chunks are large to keep pickling and IPC overhead low, the last chunks are small so that
+    expensive numbers don't leave workers idle at the end. Only chunks_per_worker chunks per worker are in flight:
+    a worker which is done picks up the next chunk while slow workers are still busy.
+    :param numbers: list of numbers
+    :param max_workers: number of worker processes; default: number of CPUs
+    :param engine: name of factoring engine
+    :param min_chunk_size: lower bound for the chunk size
+    :param chunks_per_worker: number of chunks per worker in flight
+    :param quiet: suppress per number logging in the worker processes
+    :param pool: existing process pool to use, e.g. from get_warm_pool(); is not shut down. None: use a new pool
+    :return: list of lists of prime factors; same order as numbers
+    """
+    if pool is not None:
+        max_workers = pool.max_workers
+        executor_context = contextlib.nullcontext(pool)
+    else:
+        max_workers = max_workers or os.cpu_count()
+        executor_context = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                                  initializer=quiet_worker if quiet else None)
+    results = [None] * len(numbers)
+    # pid -> [busy time, no of chunks, end of last chunk]
+    workers = {}
+    start = time.time()
+    with executor_context as executor:
+        pending = {}
+        submitted = 0
+        while submitted < len(numbers) or pending:
+            while submitted < len(numbers) and len(pending) < chunks_per_worker * max_workers:
+                size = guided_chunk_size(len(numbers) - submitted, max_workers, min_chunk_size, chunks_per_worker)
+                chunk = numbers[submitted:submitted + size]
+                pending[executor.submit(factor_chunk, chunk, engine)] = submitted
+                submitted += len(chunk)
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for completed_future in done:
+                offset = pending.pop(completed_future)
+                pid, chunk_start, chunk_end, factors = completed_future.result()
+                results[offset:offset + len(factors)] = factors
+                busy, chunks, last = workers.get(pid, (0.0, 0, 0.0))
+                workers[pid] = (busy + chunk_end - chunk_start, chunks + 1, max(last, chunk_end))
+    elapsed = time.time() - start
+    for pid, (busy, chunks, last) in sorted(workers.items()):
+        log.info(f'worker {pid}: {chunks} chunks, busy {busy * 1000:10.3f}ms, utilization {busy / elapsed:6.1%}, '
+                 f'idle for {(start + elapsed - last) * 1000:.3f}ms at the end')
+    return results
+
+
+def benchmark_chunked(no_of_products=2000, max_workers=None, engine='rho'):
+    """
+    Compare one future per number with chunked submission in a process pool
+    :param no_of_products: number of products to factorize
+    :param max_workers: number of worker processes; default: number of CPUs
+    :param engine: name of factoring engine
+    :return: None
+    """
+    max_workers = max_workers or os.cpu_count()
+    numbers = generate_products(no_of_products=no_of_products)
+    factoring = FACTORING_ENGINES[engine]
+    # per number logging in the workers would dominate
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=quiet_worker) as executor:
+        future_map = {executor.submit(factoring, number): i for i, number in enumerate(numbers)}
+        per_number = [None] * len(numbers)
+        for completed_future in concurrent.futures.as_completed(future_map):
+            per_number[future_map[completed_future]] = completed_future.result()
+    per_number_time = time.perf_counter() - start
+    start = time.perf_counter()
+    chunked = factor_chunked(numbers, max_workers=max_workers, engine=engine, quiet=True)
+    chunked_time = time.perf_counter() - start
+    if chunked != per_number:
+        raise AssertionError('chunked and per number results disagree')
+    log.info(f'per number: factorizing {len(numbers)} products took {per_number_time * 1000:10.3f}ms')
+    log.info(f'   chunked: factorizing {len(numbers)} products took {chunked_time * 1000:10.3f}ms, '
+             f'{per_number_time / chunked_time:.1f}x')
+
+
+# shared memory block of the worker process, attached by the pool initializer
+_shared_results = None
+
+
+def attach_shared_results(name, quiet=False):
+    """
+    Initializer for worker processes: attach to the shared memory block the factors are written to
+    :param name: name of the shared memory block
+    :param quiet: only log warnings and errors
+    """
+    global _shared_results
+    _shared_results = shared_memory.SharedMemory(name=name)
+    if quiet:
+        quiet_worker()
+
+
+def shared_results_layout(buffer, count):
+    """
+    Views on a shared result buffer for count numbers. The buffer is an array of uint64:
+    offsets (count + 1) | counts (count) | factors. The factors of the i-th number are stored in
+    factors[offsets[i]:offsets[i] + counts[i]].
+    :param buffer: buffer of the shared memory block
+    :param count: number of numbers
+    :return: tuple: offsets, counts, factors
+    """
+    values = np.ndarray((len(buffer) // 8,), dtype=np.uint64, buffer=buffer)
+    return values[:count + 1], values[count + 1:2 * count + 1], values[2 * count + 1:]
+
+
+def factor_chunk_shared(numbers, first, count, engine):
+    """
+    Factorize a chunk of numbers in a worker process and write the factors to the shared result buffer
+    :param numbers: list of numbers
+    :param first: index of the first number of the chunk
+    :param count: total number of numbers in the shared result buffer
+    :param engine: name of factoring engine
+    :return: tuple: worker pid, start and end time of processing, index of first number, number of numbers
+    """
+    start = time.time()
+    factoring = FACTORING_ENGINES[engine]
+    offsets, counts, factors = shared_results_layout(_shared_results.buf, count)
+    for i, number in enumerate(numbers, first):
+        number_factors = factoring(number)
+        if any(f >> 64 for f in number_factors):
+            raise OverflowError(f'factors of {number} do not fit into 64 bits')
+        offset = int(offsets[i])
+        factors[offset:offset + len(number_factors)] = number_factors
+        counts[i] = len(number_factors)
+    return os.getpid(), start, time.time(), first, len(numbers)
+
+
+def factor_shared(numbers, max_workers=None, engine='trivial', min_chunk_size=1, chunks_per_worker=2, quiet=False):
+    """
+    Factorize numbers in a process pool like factor_chunked(), but the workers write the factors directly to a shared
+    memory block instead of returning them as pickled lists. The workers only return a small completion notice per
+    chunk.
+    A number n has at most n.bit_length() prime factors; this is the space reserved per number in the factor buffer.
+    All prime factors need to fit into 64 bits.
+    :param numbers: list of numbers
+    :param max_workers: number of worker processes; default: number of CPUs
+    :param engine: name of factoring engine
+    :param min_chunk_size: lower bound for the chunk size
+    :param chunks_per_worker: number of chunks per worker in flight
+    :param quiet: suppress per number logging in the worker processes
+    :return: list of lists of prime factors; same order as numbers
+    """
+    max_workers = max_workers or os.cpu_count()
+    count = len(numbers)
+    reserved = np.cumsum([0] + [n.bit_length() for n in numbers], dtype=np.uint64)
+    block = shared_memory.SharedMemory(create=True, size=max(1, (2 * count + 1 + int(reserved[-1])) * 8))
+    try:
+        offsets, counts, factors = shared_results_layout(block.buf, count)
+        offsets[:] = reserved
+        counts[:] = 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=attach_shared_results,
+                                                    initargs=(block.name, quiet)) as executor:
+            pending = set()
+            submitted = 0
+            while submitted < count or pending:
+                while submitted < count and len(pending) < chunks_per_worker * max_workers:
+                    size = guided_chunk_size(count - submitted, max_workers, min_chunk_size, chunks_per_worker)
+                    chunk = numbers[submitted:submitted + size]
+                    pending.add(executor.submit(factor_chunk_shared, chunk, submitted, count, engine))
+                    submitted += len(chunk)
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for completed_future in done:
+                    # raises exceptions from the worker
+                    completed_future.result()
+        # convert to Python ints only once all workers are done
+        flat = factors.tolist()
+        results = [flat[offset:offset + n] for offset, n in zip(offsets[:-1].tolist(), counts.tolist())]
+        # drop views on the buffer before closing the shared memory block
+        del offsets, counts, factors
+    finally:
+        block.close()
+        block.unlink()
+    return results
+
+
+def benchmark_shared(no_of_products=500, max_workers=None, engine='rho'):
+    """
+    Compare pickled factor lists (factor_chunked()) with the shared memory result transport (factor_shared()).
+    Reports the bytes pickled for tasks and results and the CPU time spent in the parent process.
+    :param no_of_products: number of products to factorize
+    :param max_workers: number of worker processes; default: number of CPUs
+    :param engine: name of factoring engine
+    :return: None
+    """
+    max_workers = max_workers or os.cpu_count()
+    numbers = generate_products(no_of_products=no_of_products)
+    results = {}
+    timings = {}
+    for name, factor in (('pickled', factor_chunked), ('shared', factor_shared)):
+        # parent CPU time: submitting tasks, unpickling and collecting results
+        cpu, start = time.process_time(), time.perf_counter()
+        results[name] = factor(numbers, max_workers=max_workers, engine=engine, quiet=True)
+        timings[name] = (time.perf_counter() - start, time.process_time() - cpu)
+    if results['pickled'] != results['shared']:
+        raise AssertionError('pickled and shared memory results disagree')
+
+    # bytes pickled for the same chunks in both modes: (tasks, results)
+    pickled = {'pickled': [0, 0], 'shared': [0, 0]}
+    submitted = 0
+    while submitted < len(numbers):
+        size = guided_chunk_size(len(numbers) - submitted, max_workers)
+        chunk = numbers[submitted:submitted + size]
+        factors = results['pickled'][submitted:submitted + size]
+        now = time.time()
+        pickled['pickled'][0] += len(pickle.dumps((factor_chunk, (chunk, engine))))
+        pickled['pickled'][1] += len(pickle.dumps((os.getpid(), now, now, factors)))
+        pickled['shared'][0] += len(pickle.dumps((factor_chunk_shared, (chunk, submitted, len(numbers), engine))))
+        pickled['shared'][1] += len(pickle.dumps((os.getpid(), now, now, submitted, len(chunk))))
+        submitted += len(chunk)
+
+    for name, (elapsed, cpu) in timings.items():
+        log.info(f'{name:>7}: factorizing {len(numbers)} products took {elapsed * 1000:10.3f}ms, '
+                 f'parent CPU {cpu * 1000:8.3f}ms, '
+                 f'pickled: tasks {pickled[name][0]} bytes, results {pickled[name][1]} bytes')
+
+
+# cancel event of the worker process, set by the pool initializer
+_cancel_event = None
+
+
+def init_cancel_event(event, quiet=False):
+    """
+    Initializer for worker processes: make the batch cancel event available to factoring jobs
+    :param event: multiprocessing.Event
+    :param quiet: only log warnings and errors
+    """
+    global _cancel_event
+    _cancel_event = event
+    if quiet:
+        quiet_worker()
+
+
+def factor_job(n, engine, deadline=None, cancel=None):
+    """
+    Factorize a number as cancellable job. trivial_factoring() checks for cancellation while dividing, all other
+    engines only before they start.
+    :param n: number to factorize
+    :param engine: name of factoring engine
+    :param deadline: time.monotonic() value or None
+    :param cancel: cancel event; default: cancel event of the worker process
+    :return: list of prime factors
+    """
+    cancel = cancel or _cancel_event
+    check_cancelled(deadline, cancel)
+    if engine == 'trivial':
+        return trivial_factoring(n, deadline=deadline, cancel=cancel)
+    return FACTORING_ENGINES[engine](n)
+
+
+class FactoringJobs:
+    """
+    Batch of cancellable factoring jobs on a thread or process pool. Each job can have a deadline; running jobs
+    check for their deadline and for cancellation of the batch while they run. cancel() stops running jobs within
+    CANCEL_CHECK_INTERVAL divisions and drops all jobs not started yet: the workers are free right away.
+    Can be used as context manager; leaving the context cancels all jobs which are still pending.
+    """
+
+    def __init__(self, kind='process', max_workers=None, engine='trivial', quiet=False):
+        """
+        :param kind: thread or process
+        :param max_workers: number of workers
+        :param engine: name of factoring engine
+        :param quiet: suppress per number logging in worker processes
+        """
+        self.engine = engine
+        # number -> future
+        self.futures = {}
+        if kind == 'thread':
+            self.cancel_event = threading.Event()
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        elif kind == 'process':
+            self.cancel_event = multiprocessing.Event()
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers,
+                                                                   initializer=init_cancel_event,
+                                                                   initargs=(self.cancel_event, quiet))
+        else:
+            raise ValueError(f'unknown executor type: {kind}')
+        # thread workers get the event as argument; process workers have it from the initializer
+        self.job_cancel = self.cancel_event if kind == 'thread' else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cancel()
+
+    def submit(self, number, timeout=None):
+        """
+        Submit a factoring job
+        :param number: number to factorize
+        :param timeout: max time in seconds from now until the job has to be done; None: no deadline
+        :return: future
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        future = self.executor.submit(factor_job, number, self.engine, deadline, self.job_cancel)
+        self.futures[future] = number
+        return future
+
+    def results(self, first=None):
+        """
+        Iterate over results in order of completion; optionally cancel the batch after the first successful results
+        :param first: cancel the batch after that many factorizations; None: wait for all jobs
+        :return: generator of tuples: number, list of prime factors or None, exception or None
+        """
+        done = 0
+        for completed_future in concurrent.futures.as_completed(self.futures):
+            number = self.futures[completed_future]
+            try:
+                factors = completed_future.result()
+            except (FactoringCancelled, concurrent.futures.CancelledError) as e:
+                yield number, None, e
+                continue
+            yield number, factors, None
+            done += 1
+            if first is not None and done >= first:
+                self.cancel()
+                return
+
+    def cancel(self):
+        """
+        Cancel all jobs and shut down the pool; running jobs stop at their next check for cancellation
+        """
+        self.cancel_event.set()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+def benchmark_cancel(no_of_products=4, max_workers=2, first=1, timeout=2.0, kind='process'):
+    """
+    Compare leaving a plain pool after the first results with cancelling a batch of FactoringJobs, and show per job
+    deadlines bounding the batch run time
+    :param no_of_products: number of products to factorize
+    :param max_workers: number of workers
+    :param first: number of results to wait for
+    :param timeout: per job deadline in seconds for the deadline run
+    :param kind: thread or process
+    :return: None
+    """
+    numbers = generate_products(no_of_products=no_of_products)
+    level = log.level
+    log.setLevel(logging.WARNING)
+    try:
+        start = time.perf_counter()
+        executor_class = (concurrent.futures.ThreadPoolExecutor if kind == 'thread'
+                          else concurrent.futures.ProcessPoolExecutor)
+        with executor_class(max_workers=max_workers) as executor:
+            futures = [executor.submit(trivial_factoring, number) for number in numbers]
+            for i, completed_future in enumerate(concurrent.futures.as_completed(futures), 1):
+                first_results = time.perf_counter() - start
+                if i == first:
+                    break
+        plain = (first_results, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with FactoringJobs(kind=kind, max_workers=max_workers, quiet=True) as jobs:
+            for number in numbers:
+                jobs.submit(number)
+            for _ in jobs.results(first=first):
+                pass
+            first_results = time.perf_counter() - start
+        cancelled = (first_results, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        with FactoringJobs(kind=kind, max_workers=max_workers, quiet=True) as jobs:
+            for number in numbers:
+                jobs.submit(number, timeout=timeout)
+            outcome = collections.Counter(type(error).__name__ if error else 'done' for _, _, error in jobs.results())
+        deadline = time.perf_counter() - start
+    finally:
+        log.setLevel(level)
+    log.info(f'    plain pool: first {first} results after {plain[0] * 1000:10.3f}ms, '
+             f'pool shut down after {plain[1] * 1000:10.3f}ms')
+    log.info(f'FactoringJobs: first {first} results after {cancelled[0] * 1000:10.3f}ms, '
+             f'pool shut down after {cancelled[1] * 1000:10.3f}ms')
+    log.info(f'FactoringJobs, {timeout}s deadline: {no_of_products} jobs done after {deadline * 1000:10.3f}ms: '
+             f'{", ".join(f"{n} {result}" for result, n in outcome.items())}')
+
+
+def preload_engine(engine):
+    """
+    Do the expensive setup of a factoring engine which can be shared: in the parent before forking or in a worker
+    :param engine: name of factoring engine
+    """
+    if engine == 'sieve':
+        prime_table(BATCH_BOUND)
+
+
+def preload_worker(engine, quiet=False, cache_size=100000, cache_path=None):
+    """
+    Initializer for worker processes: do the expensive setup of a factoring engine once per worker instead of in the
+    first job
+    :param engine: name of factoring engine
+    :param quiet: only log warnings and errors
+    :param cache_size: max number of cached factorizations in memory; only used by the cached engine
+    :param cache_path: path of the SQLite database of the cached engine
+    """
+    if quiet:
+        quiet_worker()
+    preload_engine(engine)
+    if engine == 'cached':
+        # each worker has its own in memory cache
+        init_factor_cache(max_size=cache_size, path=cache_path)
+
+
+def worker_pid():
+    """
+    Trivial job to check that a worker process is up
+    :return: pid of the worker process
+    """
+    return os.getpid()
+
+
+class WarmProcessPool:
+    """
+    Long-lived process pool which is reused across batches. Workers are started with a configurable start method
+    (fork, forkserver or spawn) and preload what the factoring engine needs:
+    * fork: the parent preloads; the workers inherit its memory
+    * forkserver: the fork server imports this module (and NumPy) once; the workers are forked from it
+    * spawn: each worker imports the module and preloads in the pool initializer
+    warm_up() starts all workers before the first batch is submitted. The cached engine gets the settings of the
+    process wide factor cache.
+    Can be used as context manager; the pool is shut down on exit.
+    """
+
+    def __init__(self, max_workers=None, start_method=None, engine='trivial', quiet=False, preload=True):
+        """
+        :param max_workers: number of worker processes; default: number of CPUs
+        :param start_method: fork, forkserver or spawn; None: platform default
+        :param engine: name of factoring engine to preload
+        :param quiet: suppress per number logging in the worker processes
+        :param preload: preload in the parent (fork) or the fork server; False: workers only set up in the initializer
+        """
+        self.max_workers = max_workers or os.cpu_count()
+        context = multiprocessing.get_context(start_method)
+        self.start_method = context.get_start_method()
+        if preload and self.start_method == 'fork':
+            # the process wide factor cache of the parent is left alone
+            preload_engine(engine)
+        elif preload and self.start_method == 'forkserver':
+            context.set_forkserver_preload(['__main__'])
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=context, initializer=preload_worker,
+            initargs=(engine, quiet, FACTOR_CACHE.max_size, FACTOR_CACHE.path))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def warm_up(self):
+        """
+        Start all worker processes and wait until they are ready
+        :return: set of worker pids
+        """
+        # workers are started on demand: one per job submitted while no worker is idle
+        futures = [self.executor.submit(worker_pid) for _ in range(self.max_workers)]
+        return {future.result() for future in futures}
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def map(self, fn, *iterables, chunksize=1):
+        return self.executor.map(fn, *iterables, chunksize=chunksize)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+# persistent pools: (max_workers, start method, engine, quiet) -> WarmProcessPool
+_warm_pools = {}
+_warm_pools_lock = threading.Lock()
+
+
+def get_warm_pool(max_workers=None, start_method=None, engine='trivial', quiet=True):
+    """
+    Get a warmed up process pool; pools are created on first use and reused for all later batches. Don't shut down
+    the pool; all pools are shut down at exit
+    :param max_workers: number of worker processes; default: number of CPUs
+    :param start_method: fork, forkserver or spawn; None: platform default
+    :param engine: name of factoring engine to preload
+    :param quiet: suppress per number logging in the worker processes
+    :return: WarmProcessPool
+    """
+    key = (max_workers or os.cpu_count(), start_method or multiprocessing.get_start_method(), engine, quiet)
+    with _warm_pools_lock:
+        pool = _warm_pools.get(key)
+        if pool is None:
+            pool = WarmProcessPool(max_workers=key[0], start_method=key[1], engine=engine, quiet=quiet)
+            pool.warm_up()
+            _warm_pools[key] = pool
+        return pool
+
+
+@atexit.register
+def shutdown_warm_pools():
+    """
+    Shut down all persistent pools
+    """
+    with _warm_pools_lock:
+        while _warm_pools:
+            _warm_pools.popitem()[1].shutdown()
+
+
+def benchmark_warm_pool(no_of_products=4, max_workers=2, engine='sieve', batches=3, start_methods=None):
+    """
+    Time to first result and batch time for a new pool per batch (cold) versus a persistent, warmed up pool
+    :param no_of_products: number of products per batch
+    :param max_workers: number of worker processes
+    :param engine: name of factoring engine
+    :param batches: number of batches
+    :param start_methods: start methods to compare; default: all available
+    :return: None
+    """
+    factoring = FACTORING_ENGINES[engine]
+    results = []
+    level = log.level
+    log.setLevel(logging.WARNING)
+    try:
+        for start_method in start_methods or multiprocessing.get_all_start_methods():
+            for warm in (False, True):
+                if warm:
+                    start = time.perf_counter()
+                    pool = WarmProcessPool(max_workers=max_workers, start_method=start_method, engine=engine,
+                                           quiet=True)
+                    pool.warm_up()
+                    startup = time.perf_counter() - start
+                first_results = []
+                batch_times = []
+                for _ in range(batches):
+                    numbers = generate_products(no_of_products=no_of_products)
+                    start = time.perf_counter()
+                    if not warm:
+                        # no preloading in the parent: forked workers would inherit the preloaded state
+                        pool = WarmProcessPool(max_workers=max_workers, start_method=start_method, engine=engine,
+                                               quiet=True, preload=False)
+                    futures = [pool.submit(factoring, number) for number in numbers]
+                    for i, completed_future in enumerate(concurrent.futures.as_completed(futures)):
+                        completed_future.result()
+                        if not i:
+                            first_results.append(time.perf_counter() - start)
+                    if not warm:
+                        pool.shutdown()
+                    batch_times.append(time.perf_counter() - start)
+                if warm:
+                    pool.shutdown()
+                results.append((start_method, 'warm' if warm else 'cold', statistics.median(first_results),
+                                statistics.median(batch_times), startup if warm else None))
+    finally:
+        log.setLevel(level)
+    for start_method, pool_type, first_result, batch_time, startup in results:
+        log.info(f'{start_method:>10}, {pool_type}: first result after {first_result * 1000:10.3f}ms, '
+                 f'batch of {no_of_products} took {batch_time * 1000:10.3f}ms' +
+                 (f', one time startup {startup * 1000:10.3f}ms' if startup is not None else ''))
+
+
+def factor_sjf(numbers, max_workers=None, engine='rho', latencies=None):
+    """
+    Factorize numbers in a thread pool shortest job first: the bit length of a number is used as estimate of the cost
+    :param numbers: list of numbers
+    :param max_workers: number of worker threads
+    :param engine: name of factoring engine
+    :param latencies: optional list; latencies from submission to completion are appended in order of numbers
+    :return: list of lists of prime factors; same order as numbers
+    """
+    factoring = FACTORING_ENGINES[engine]
+
+    def timed(number, submitted):
+        factors = factoring(number)
+        return factors, time.perf_counter() - submitted
+
+    with PriorityExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit_with(number.bit_length(), None, timed, number, time.perf_counter())
+                   for number in numbers]
+    results = [future.result() for future in futures]
+    if latencies is not None:
+        latencies.extend(latency for _, latency in results)
+    return [factors for factors, _ in results]
+
+
+def benchmark_sjf(no_of_products=200, max_workers=4, engine='rho'):
+    """
+    Latency of small and large numbers in a mixed batch: FIFO ThreadPoolExecutor vs. shortest job first. The batch
+    has as many small numbers (product of two primes < 10000) as products from generate_products(), shuffled.
+    :param no_of_products: number of products from generate_products()
+    :param max_workers: number of worker threads
+    :param engine: name of factoring engine
+    :return: None
+    """
+    primes = small_primes(10000)[len(SMALL_PRIMES):]
+    numbers = generate_products(no_of_products=no_of_products)
+    numbers += [random.choice(primes) * random.choice(primes) for _ in range(no_of_products)]
+    random.shuffle(numbers)
+    factoring = FACTORING_ENGINES[engine]
+
+    def timed(number, submitted):
+        factors = factoring(number)
+        return factors, time.perf_counter() - submitted
+
+    level = log.level
+    log.setLevel(logging.WARNING)
+    try:
+        results = {}
+        for name in ('FIFO', 'SJF'):
+            start = time.perf_counter()
+            if name == 'FIFO':
+                with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = [executor.submit(timed, number, time.perf_counter()) for number in numbers]
+                timings = [future.result() for future in futures]
+            else:
+                latencies = []
+                factors = factor_sjf(numbers, max_workers=max_workers, engine=engine, latencies=latencies)
+                timings = list(zip(factors, latencies))
+            results[name] = (timings, time.perf_counter() - start)
+    finally:
+        log.setLevel(level)
+    if [f for f, _ in results['FIFO'][0]] != [f for f, _ in results['SJF'][0]]:
+        raise AssertionError('FIFO and SJF results disagree')
+    for name, (timings, elapsed) in results.items():
+        for size in ('small', 'large'):
+            latencies = [latency for number, (_, latency) in zip(numbers, timings)
+                         if (number.bit_length() < 32) == (size == 'small')]
+            log.info(f'{name:>4}: {size} numbers: latency p50 {statistics.median(latencies) * 1000:10.3f}ms, '
+                     f'p95 {percentile(latencies, 0.95) * 1000:10.3f}ms, '
+                     f'p99 {percentile(latencies, 0.99) * 1000:10.3f}ms')
+        log.info(f'{name:>4}: all {len(numbers)} numbers done after {elapsed * 1000:10.3f}ms')
+
+
+def sweep_executor(kind, max_workers):
+    """
+    Create an executor for a sweep run
+    :param kind: thread, process or interpreter
+    :param max_workers: number of workers
+    :return: concurrent.futures.Executor
+    """
+    if kind == 'thread':
+        return concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    if kind == 'process':
+        return concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=quiet_worker)
+    if kind == 'interpreter':
+        # Python 3.14+: one interpreter (with its own GIL) per worker thread
+        return concurrent.futures.InterpreterPoolExecutor(max_workers=max_workers, initializer=quiet_worker)
+    raise ValueError(f'unknown executor type: {kind}')
+
+
+def sweep_run(kind, factoring, numbers, max_workers):
+    """
+    Factorize numbers once; executor startup and shutdown are part of the measurement
+    :param kind: sequential, thread, process or interpreter
+    :param factoring: factoring function
+    :param numbers: list of numbers
+    :param max_workers: number of workers
+    :return: elapsed time in seconds
+    """
+    start = time.perf_counter()
+    if kind == 'sequential':
+        for number in numbers:
+            factoring(number)
+    else:
+        with sweep_executor(kind, max_workers) as executor:
+            for completed_future in concurrent.futures.as_completed([executor.submit(factoring, number)
+                                                                     for number in numbers]):
+                completed_future.result()
+    return time.perf_counter() - start
+
+
+def sweep_metadata():
+    """
+    Describe interpreter and host so that results from different Python versions and hosts can be compared
+    :return: dict
+    """
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    return {'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'gil_enabled': is_gil_enabled() if is_gil_enabled else True,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')}
+
+
+SWEEP_EXECUTORS = ['sequential', 'thread', 'process', 'interpreter']
+
+
+def benchmark_sweep(products=(5, 20), workers=(1, 2, 4), executors=('sequential', 'thread', 'process'),
+                    engine='rho', warmups=1, repeats=5, output=None, seed=0):
+    """
+    Benchmark harness: sweep product count, worker count and executor type. Each combination is run warmups times
+    w/o measurement and then repeats times. For each combination median, p95, speedup (relative to the sequential
+    median for the same product count) and parallel efficiency (speedup per worker) are reported.
+    :param products: product counts to sweep
+    :param workers: worker counts to sweep; sequential runs always use one worker
+    :param executors: executor types to sweep; see SWEEP_EXECUTORS
+    :param engine: name of factoring engine
+    :param warmups: number of runs w/o measurement per combination
+    :param repeats: number of measured runs per combination
+    :param output: path of the result file; .csv: CSV, anything else: JSON; None: only log results
+    :param seed: random seed for generate_products(); same products across runs, hosts and Python versions
+    :return: list of result dicts
+    """
+    if 'interpreter' in executors and not hasattr(concurrent.futures, 'InterpreterPoolExecutor'):
+        log.warning(f'Python {platform.python_version()} has no InterpreterPoolExecutor, skipping interpreter runs')
+        executors = [e for e in executors if e != 'interpreter']
+    factoring = FACTORING_ENGINES[engine]
+    metadata = sweep_metadata()
+    metadata.update(engine=engine, warmups=warmups, repeats=repeats, seed=seed)
+    results = []
+    level = log.level
+    for no_of_products in products:
+        random.seed(seed)
+        numbers = generate_products(no_of_products=no_of_products)
+        # sequential first: baseline for speedup
+        baseline = None
+        for kind in sorted(executors, key=lambda e: e != 'sequential'):
+            for max_workers in ([1] if kind == 'sequential' else workers):
+                log.setLevel(logging.WARNING)
+                try:
+                    for _ in range(warmups):
+                        sweep_run(kind, factoring, numbers, max_workers)
+                    timings = [sweep_run(kind, factoring, numbers, max_workers) for _ in range(repeats)]
+                finally:
+                    log.setLevel(level)
+                median = statistics.median(timings)
+                if kind == 'sequential':
+                    baseline = median
+                speedup = baseline / median if baseline else None
+                result = {'products': no_of_products, 'executor': kind, 'workers': max_workers,
+                          'median_ms': median * 1000, 'p95_ms': percentile(timings, 0.95) * 1000,
+                          'min_ms': min(timings) * 1000, 'max_ms': max(timings) * 1000,
+                          'speedup': speedup, 'efficiency': speedup / max_workers if speedup else None}
+                results.append(result)
+                log.info(f'{no_of_products:6} products, {kind:>11}, {max_workers:3} workers: '
+                         f'median {result["median_ms"]:10.3f}ms, p95 {result["p95_ms"]:10.3f}ms' +
+                         (f', speedup {speedup:5.2f}x, efficiency {result["efficiency"]:6.1%}' if speedup else ''))
+    if output:
+        if output.endswith('.csv'):
+            with open(output, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(results[0]) + list(metadata))
+                writer.writeheader()
+                for result in results:
+                    writer.writerow({**result, **metadata})
+        else:
+            with open(output, 'w') as f:
+                json.dump({'metadata': metadata, 'results': results}, f, indent=2)
+        log.info(f'wrote {len(results)} results to {output}')
+    return results
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Factorize products of large primes in threads and processes')
+    parser.add_argument('--engine', choices=FACTORING_ENGINES, default='trivial', help='factoring engine to use')
+    parser.add_argument('--products', type=int, default=5, help='number of products to factorize')
+    parser.add_argument('--max-workers', type=int, default=5, help='number of worker threads/processes')
+    parser.add_argument('--benchmark',
+                        choices=['engines', 'batch', 'chunked', 'shared', 'cache', 'sweep', 'cancel', 'warm', 'sjf'],
+                        help='run a benchmark instead of the examples')
+    parser.add_argument('--engines', default=','.join(FACTORING_ENGINES),
+                        help='comma separated list of engines to compare; the first one is the reference')
+    parser.add_argument('--factor-cache', metavar='PATH',
+                        help='SQLite database to persist factorizations of the cached engine')
+    parser.add_argument('--cache-size', type=int, default=100000,
+                        help='max number of factorizations the cached engine keeps in memory')
+    parser.add_argument('--start-method', choices=multiprocessing.get_all_start_methods(),
+                        help='start method of worker processes; --benchmark warm: default: compare all')
+    parser.add_argument('--trace', metavar='PREFIX',
+                        help='write timelines of the thread and process pool runs in Chrome trace format to '
+                             'PREFIX-threads.json and PREFIX-processes.json')
+    sweep = parser.add_argument_group('sweep', 'options for --benchmark sweep')
+    sweep.add_argument('--sweep-products', default='5,20', help='comma separated list of product counts')
+    sweep.add_argument('--sweep-workers', default='1,2,4', help='comma separated list of worker counts')
+    sweep.add_argument('--executors', default='sequential,thread,process',
+                       help=f'comma separated list of executor types: {",".join(SWEEP_EXECUTORS)}')
+    sweep.add_argument('--warmups', type=int, default=1, help='runs w/o measurement per combination')
+    sweep.add_argument('--repeats', type=int, default=5, help='measured runs per combination')
+    sweep.add_argument('--seed', type=int, default=0, help='random seed for the products')
+    sweep.add_argument('--output', help='result file; .csv for CSV, JSON otherwise')
+    args = parser.parse_args()
+    init_factor_cache(max_size=args.cache_size, path=args.factor_cache)
+
+    if args.benchmark == 'engines':
+        benchmark_engines(engines=args.engines.split(','), no_of_products=args.products)
+        return
+    if args.benchmark == 'batch':
+        benchmark_batch(no_of_products=args.products)
+        return
+    if args.benchmark == 'chunked':
+        benchmark_chunked(no_of_products=args.products, max_workers=args.max_workers, engine=args.engine)
+        return
+    if args.benchmark == 'shared':
+        benchmark_shared(no_of_products=args.products, max_workers=args.max_workers, engine=args.engine)
+        return
+    if args.benchmark == 'sweep':
+        executors = args.executors.split(',')
+        unknown = set(executors) - set(SWEEP_EXECUTORS)
+        if unknown:
+            parser.error(f'unknown executor types: {",".join(sorted(unknown))}')
+        benchmark_sweep(products=[int(p) for p in args.sweep_products.split(',')],
+                        workers=[int(w) for w in args.sweep_workers.split(',')],
+                        executors=executors, engine=args.engine, warmups=args.warmups, repeats=args.repeats,
+                        output=args.output, seed=args.seed)
+        return
+    if args.benchmark == 'sjf':
+        benchmark_sjf(no_of_products=args.products, max_workers=args.max_workers, engine=args.engine)
+        return
+    if args.benchmark == 'warm':
+        benchmark_warm_pool(no_of_products=args.products, max_workers=args.max_workers, engine=args.engine,
+                            start_methods=args.start_method and [args.start_method])
+        return
+    if args.benchmark == 'cancel':
+        benchmark_cancel(no_of_products=args.products, max_workers=args.max_workers)
+        return
+    if args.benchmark == 'cache':
+        benchmark_cache(no_of_products=args.products, max_workers=args.max_workers, path=args.factor_cache)
+        return
+
+    factoring = FACTORING_ENGINES[args.engine]
+
     start = time.perf_counter()
-    numbers = generate_products(no_of_products=5)
+    numbers = generate_products(no_of_products=args.products)
     log.info(f'creating {len(numbers)} products took {(time.perf_counter() - start) * 1000:.3f}ms')
 
     # First try to factorize the numbers sequentially in a single thread
     log.info('=' * 100)
     start = time.perf_counter()
     for i, number in enumerate(numbers):
-        factors = trivial_factoring(number)
+        factors = factoring(number)
         log.info(f'factors of {number}: {",".join(f"{n}" for n in factors)}')
     log.info(f'factorizing {len(numbers)} products took {(time.perf_counter() - start) * 1000:.3f}ms')
+    if args.engine == 'cached':
+        FACTOR_CACHE.log_stats('sequential')
 
     # Now, let's try to create a thread for each number
     log.info('=' * 100)
     start = time.perf_counter()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-        future_map = {executor.submit(trivial_factoring, number): number for number in numbers}
+    with InstrumentedExecutor(concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers),
+                              logger=log) as executor:
+        future_map = {executor.submit(factoring, number): number for number in numbers}
         for completed_future in concurrent.futures.as_completed(future_map):
             number = future_map[completed_future]
             factors = completed_future.result()
-            log.info(f'factors of {number}: {",".join(f"{n}" for n in factors)}')
+            log.info(f'factors of {number}: {",".join(f"{n}" for n in factors)}, {executor.progress_line()}')
     log.info(f'factorizing {len(numbers)} products took {(time.perf_counter() - start) * 1000:.3f}ms')
+    executor.log_summary()
+    if args.trace:
+        executor.write_trace(f'{args.trace}-threads.json')
+    if args.engine == 'cached':
+        FACTOR_CACHE.log_stats('threads')
 
-    # finally, let's try a process per number
+    # finally, let's try a process per number. The process pool is long-lived and reused for the next batch
     log.info('=' * 100)
     start = time.perf_counter()
-    with concurrent.futures.ProcessPoolExecutor(max_workers=5) as executor:
-        future_map = {executor.submit(trivial_factoring, number): number for number in numbers}
-        for completed_future in concurrent.futures.as_completed(future_map):
-            number = future_map[completed_future]
-            factors = completed_future.result()
-            log.info(f'factors of {number}: {",".join(f"{n}" for n in factors)}')
+    pool = get_warm_pool(max_workers=args.max_workers, start_method=args.start_method, engine=args.engine,
+                         quiet=False)
+    log.info(f'starting {pool.max_workers} {pool.start_method} worker processes took '
+             f'{(time.perf_counter() - start) * 1000:.3f}ms')
+    start = time.perf_counter()
+    executor = InstrumentedExecutor(pool, name='ProcessPoolExecutor', logger=log)
+    future_map = {executor.submit(factoring, number): number for number in numbers}
+    for completed_future in concurrent.futures.as_completed(future_map):
+        number = future_map[completed_future]
+        factors = completed_future.result()
+        log.info(f'factors of {number}: {",".join(f"{n}" for n in factors)}, {executor.progress_line()}')
+    log.info(f'factorizing {len(numbers)} products took {(time.perf_counter() - start) * 1000:.3f}ms')
+    executor.log_summary()
+    if args.trace:
+        executor.write_trace(f'{args.trace}-processes.json')
+
+    # process pool again, but submit chunks of numbers instead of single numbers
+    log.info('=' * 100)
+    start = time.perf_counter()
+    for number, factors in zip(numbers, factor_chunked(numbers, engine=args.engine, pool=pool)):
+        log.info(f'factors of {number}: {",".join(f"{n}" for n in factors)}')
     log.info(f'factorizing {len(numbers)} products took {(time.perf_counter() - start) * 1000:.3f}ms')
 
 
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+Thread-safe counters.
+
+The examples 03 to 10 protect a global counter with a single lock: every increment serializes on counter_lock. This
+module offers alternatives with the same interface:
+
+* LockedCounter: one lock; increment() returns the new value. Strictly linearizable: each increment gets a unique
+  value just like update_counter_context() in the examples. Use this if the value returned by an increment matters.
+* StripedCounter: a fixed number of stripes, each with its own lock; each thread gets a stripe assigned round robin
+  on its first increment. Don't map threads to stripes by threading.get_ident(): on Linux thread idents are aligned
+  pthread addresses and ident % stripes is the same for all threads.
+* ShardedCounter: one shard per thread; a thread only ever writes to its own shard so increments need no lock at all.
+
+StripedCounter and ShardedCounter merge the shards on read: value is the sum of all increments which completed before
+the read started, increments running concurrently with the read may or may not be included. increment() returns None.
+
+Trade-off: striping only pays off if threads actually contend for the single lock. Under the GIL a thread rarely
+loses the GIL while holding a short critical section, so the single lock is hardly contended and the stripe lookup
+can cost as much as it saves; w/o the GIL or with longer critical sections contention and the benefit grow. Sharding
+takes no lock on increment at all, at the price of one shard per thread ever used and a read which has to sum all
+shards. Run the benchmark below to see the numbers for a given machine and interpreter.
+"""
+import argparse
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class LockedCounter:
+    """
+    Counter protected by a single lock. Strictly linearizable
+    """
+
+    def __init__(self, value=0):
+        self._value = value
+        self._lock = threading.Lock()
+
+    def increment(self, n=1):
+        """
+        Add to the counter
+        :param n: increment
+        :return: new value of the counter
+        """
+        with self._lock:
+            self._value += n
+            return self._value
+
+    @property
+    def value(self):
+        with self._lock:
+            return self._value
+
+
+class StripedCounter:
+    """
+    Counter split into stripes each protected by its own lock. Threads only contend if they map to the same stripe
+    """
+
+    def __init__(self, stripes=16):
+        """
+        :param stripes: number of stripes
+        """
+        self._stripes = [[0] for _ in range(stripes)]
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        # stripe index of each thread; next() on itertools.count is atomic under the GIL
+        self._local = threading.local()
+        self._next_stripe = itertools.count()
+
+    def increment(self, n=1):
+        """
+        Add to the counter
+        :param n: increment
+        """
+        try:
+            i = self._local.stripe
+        except AttributeError:
+            i = self._local.stripe = next(self._next_stripe) % len(self._stripes)
+        with self._locks[i]:
+            self._stripes[i][0] += n
+
+    @property
+    def value(self):
+        return sum(stripe[0] for stripe in self._stripes)
+
+
+class ShardedCounter:
+    """
+    Counter with one shard per thread. Each shard is only written by its thread: increments don't need a lock. The
+    shards of threads which have terminated are kept so that their increments are not lost.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        # all shards ever created; only appended to under the lock
+        self._shards = []
+        self._lock = threading.Lock()
+
+    def _shard(self):
+        shard = [0]
+        self._local.shard = shard
+        with self._lock:
+            self._shards.append(shard)
+        return shard
+
+    def increment(self, n=1):
+        """
+        Add to the counter
+        :param n: increment
+        """
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        shard[0] += n
+
+    @property
+    def value(self):
+        with self._lock:
+            shards = list(self._shards)
+        return sum(shard[0] for shard in shards)
+
+
+COUNTERS = {'locked': LockedCounter,
+            'striped': StripedCounter,
+            'sharded': ShardedCounter}
+
+
+def make_counter(strategy='sharded'):
+    """
+    Create a counter
+    :param strategy: locked (linearizable, increment() returns the new value), striped or sharded
+    :return: counter
+    """
+    return COUNTERS[strategy]()
+
+
+def count(counter, increments, start):
+    """
+    Thread target for the benchmark: wait for the start signal and increment the counter
+    """
+    start.wait()
+    increment = counter.increment
+    for _ in range(increments):
+        increment()
+
+
+def benchmark(threads=(1, 2, 4, 8, 16, 32), increments=100000, strategies=None):
+    """
+    Contention benchmark: all threads increment the same counter as fast as they can
+    :param threads: thread counts to sweep
+    :param increments: number of increments per thread
+    :param strategies: names of counter strategies; default: all
+    :return: list of tuples: strategy, threads, increments/s
+    """
+    results = []
+    for no_of_threads in threads:
+        for strategy in strategies or COUNTERS:
+            counter = make_counter(strategy)
+            start = threading.Event()
+            workers = [threading.Thread(target=count, args=(counter, increments, start)) for _ in range(no_of_threads)]
+            for t in workers:
+                t.start()
+            started = time.perf_counter()
+            start.set()
+            for t in workers:
+                t.join()
+            elapsed = time.perf_counter() - started
+            if counter.value != no_of_threads * increments:
+                raise AssertionError(f'{strategy}: expected {no_of_threads * increments}, got {counter.value}')
+            rate = no_of_threads * increments / elapsed
+            results.append((strategy, no_of_threads, rate))
+            log.info(f'{strategy:>8}, {no_of_threads:3} threads: {rate:14,.0f} increments/s')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Counter contention benchmark')
+    parser.add_argument('--threads', default='1,2,4,8,16,32', help='comma separated list of thread counts')
+    parser.add_argument('--increments', type=int, default=100000, help='number of increments per thread')
+    parser.add_argument('--strategies', default=','.join(COUNTERS),
+                        help='comma separated list of counter strategies')
+    args = parser.parse_args()
+    benchmark(threads=[int(t) for t in args.threads.split(',')], increments=args.increments,
+              strategies=args.strategies.split(','))
+
+
+if __name__ == '__main__':
+    f = logging.Formatter('%(asctime)s [%(levelname)s] [%(threadName)s] %(name)s: %(message)s')
+    h = logging.StreamHandler()
+    h.setFormatter(f)
+    log.addHandler(h)
+    log.setLevel(logging.INFO)
+
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+"""
+Hybrid executor for fetch-then-compute pipelines.
+
+I/O bound stages (like get_page() in 11-field notices.py) scale with threads; CPU bound stages (like factoring in
+12-thread_vs_process.py or heavy HTML parsing) need processes. HybridExecutor combines a thread pool for I/O stages
+with a process pool for CPU stages. submit_pipeline() chains an I/O and a CPU stage: when the I/O stage is done its
+result is handed to the process pool from a done callback, the fetch thread doesn't wait for the CPU stage and picks
+up the next fetch right away.
+"""
+import argparse
+import concurrent.futures
+import html.parser
+import http.server
+import logging
+import os
+import random
+import threading
+import time
+
+import requests
+
+log = logging.getLogger(__name__)
+
+
+class HybridExecutor:
+    """
+    Thread pool for I/O stages and process pool for CPU stages. Can be used as context manager; both pools are shut
+    down on exit.
+    """
+
+    def __init__(self, io_workers=16, cpu_workers=None, mp_context=None):
+        """
+        :param io_workers: number of threads for I/O stages
+        :param cpu_workers: number of processes for CPU stages; default: number of CPUs
+        :param mp_context: multiprocessing context for the process pool
+        """
+        self.io_workers = io_workers
+        self.io = concurrent.futures.ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='io')
+        self.cpu = concurrent.futures.ProcessPoolExecutor(max_workers=cpu_workers, mp_context=mp_context)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def submit_io(self, fn, /, *args, **kwargs):
+        return self.io.submit(fn, *args, **kwargs)
+
+    def submit_cpu(self, fn, /, *args, **kwargs):
+        return self.cpu.submit(fn, *args, **kwargs)
+
+    def submit_pipeline(self, io_fn, cpu_fn, /, *args, **kwargs):
+        """
+        Run io_fn(*args, **kwargs) in the thread pool and then cpu_fn(result of io_fn) in the process pool
+        :param io_fn: I/O stage
+        :param cpu_fn: CPU stage; needs to be picklable
+        :return: future of the result of the CPU stage
+        """
+        future = concurrent.futures.Future()
+        # futures of the I/O and CPU stage; cancelling the pipeline future cancels the stages
+        stages = []
+
+        def cancel_stages(f):
+            if f.cancelled():
+                for stage in stages:
+                    stage.cancel()
+
+        def track(stage_future):
+            stages.append(stage_future)
+            if future.cancelled():
+                # pipeline future was cancelled before the stage was tracked
+                stage_future.cancel()
+
+        def forward(stage_future, next_stage=None):
+            # done callback: runs in the thread which completed stage_future
+            if future.done():
+                # pipeline future has been cancelled: don't start the next stage
+                return
+            try:
+                if stage_future.cancelled():
+                    future.cancel()
+                    future.set_running_or_notify_cancel()
+                    return
+                error = stage_future.exception()
+                if error is not None:
+                    future.set_exception(error)
+                    return
+                if next_stage is None:
+                    future.set_result(stage_future.result())
+                    return
+            except concurrent.futures.InvalidStateError:
+                # pipeline future has been cancelled concurrently
+                return
+            try:
+                cpu_future = self.cpu.submit(next_stage, stage_future.result())
+            except Exception as e:
+                # e.g. pool has been shut down
+                try:
+                    future.set_exception(e)
+                except concurrent.futures.InvalidStateError:
+                    pass
+                return
+            track(cpu_future)
+            cpu_future.add_done_callback(forward)
+
+        future.add_done_callback(cancel_stages)
+        io_future = self.io.submit(io_fn, *args, **kwargs)
+        track(io_future)
+        io_future.add_done_callback(lambda f: forward(f, cpu_fn))
+        return future
+
+    def pipeline_map(self, io_fn, cpu_fn, iterable, window=None):
+        """
+        Run the pipeline for all items of an iterable with a bounded number of items in flight; results are yielded in
+        order of completion
+        :param io_fn: I/O stage
+        :param cpu_fn: CPU stage; needs to be picklable
+        :param iterable: arguments for io_fn
+        :param window: max number of items in flight; default: twice the number of I/O threads
+        :return: generator of tuples: item, result of the CPU stage
+        """
+        window = window or 2 * self.io_workers
+        items = iter(iterable)
+        pending = {}
+        try:
+            while True:
+                while len(pending) < window:
+                    item = next(items, StopIteration)
+                    if item is StopIteration:
+                        break
+                    pending[self.submit_pipeline(io_fn, cpu_fn, item)] = item
+                if not pending:
+                    return
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.io.shutdown(wait=wait, cancel_futures=cancel_futures)
+        self.cpu.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+class PageStats(html.parser.HTMLParser):
+    """
+    Pure Python HTML parser collecting simple statistics; CPU bound
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tags = 0
+        self.links = 0
+        self.words = 0
+
+    def handle_starttag(self, tag, attrs):
+        self.tags += 1
+        if tag == 'a':
+            self.links += 1
+
+    def handle_data(self, data):
+        self.words += len(data.split())
+
+
+def parse_page(markup, rounds=3):
+    """
+    CPU stage of the benchmark: parse a page
+    :param markup: page markup
+    :param rounds: number of times the page is parsed to make the stage CPU heavy
+    :return: tuple: number of tags, links and words
+    """
+    for _ in range(rounds):
+        parser = PageStats()
+        parser.feed(markup)
+        parser.close()
+    return parser.tags, parser.links, parser.words
+
+
+def fetch_page(url):
+    """
+    I/O stage of the benchmark: get a page
+    :param url: URL
+    :return: page markup
+    """
+    r = requests.get(url)
+    r.raise_for_status()
+    return r.text
+
+
+def fetch_and_parse(url):
+    """
+    Both stages in a single thread
+    """
+    return parse_page(fetch_page(url))
+
+
+class PageHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves generated pages with artificial latency
+    """
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        body = self.server.page
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_page(links=500):
+    rows = ''.join(f'<li><a href="/page/{i}">Item {i}</a> <span class="date">{random.randint(1, 28)}-Jun-2020</span>'
+                   f'<p>Some text describing item {i} in a few words.</p></li>\n' for i in range(links))
+    return f'<html><head><title>Test</title></head><body><ul>\n{rows}</ul></body></html>'.encode()
+
+
+def benchmark(pages=200, latency=0.05, io_workers=16, cpu_workers=None):
+    """
+    End-to-end throughput of fetch-then-parse against a local server: threads only, process pool map over the results
+    of a thread pool map (results are handed over in input order) and the pipelined hybrid executor
+    :param pages: number of pages
+    :param latency: artificial latency of the server in seconds
+    :param io_workers: number of fetch threads
+    :param cpu_workers: number of parser processes; default: number of CPUs
+    :return: None
+    """
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), PageHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.page = make_page()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f'http://127.0.0.1:{server.server_address[1]}/page/{i}' for i in range(pages)]
+    reference = parse_page(server.page.decode())
+    results = []
+    try:
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=io_workers) as executor:
+            parsed = list(executor.map(fetch_and_parse, urls))
+        results.append(('threads only', time.perf_counter() - start, parsed))
+
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=io_workers) as io, \
+                concurrent.futures.ProcessPoolExecutor(max_workers=cpu_workers) as cpu:
+            parsed = list(cpu.map(parse_page, io.map(fetch_page, urls)))
+        results.append(('io.map -> cpu.map', time.perf_counter() - start, parsed))
+
+        start = time.perf_counter()
+        with HybridExecutor(io_workers=io_workers, cpu_workers=cpu_workers) as executor:
+            parsed = [result for _, result in executor.pipeline_map(fetch_page, parse_page, urls)]
+        results.append(('hybrid pipeline', time.perf_counter() - start, parsed))
+    finally:
+        server.shutdown()
+        server.server_close()
+    for name, elapsed, parsed in results:
+        if any(p != reference for p in parsed) or len(parsed) != pages:
+            raise AssertionError(f'{name}: wrong results')
+        log.info(f'{name:>21}: {pages} pages in {elapsed * 1000:10.3f}ms, {pages / elapsed:8.1f} pages/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fetch-then-parse throughput: threads, processes and hybrid')
+    parser.add_argument('--pages', type=int, default=200, help='number of pages')
+    parser.add_argument('--latency', type=float, default=0.05, help='artificial latency of the server (seconds)')
+    parser.add_argument('--io-workers', type=int, default=16, help='number of fetch threads')
+    parser.add_argument('--cpu-workers', type=int, default=os.cpu_count(), help='number of parser processes')
+    args = parser.parse_args()
+    benchmark(pages=args.pages, latency=args.latency, io_workers=args.io_workers, cpu_workers=args.cpu_workers)
+
+
+if __name__ == '__main__':
+    f = logging.Formatter('%(asctime)s [%(levelname)s] [%(threadName)s] %(name)s: %(message)s')
+    h = logging.StreamHandler()
+    h.setFormatter(f)
+    log.addHandler(h)
+    log.setLevel(logging.INFO)
+
+    main()
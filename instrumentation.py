@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""
+Instrumentation for concurrent.futures executors.
+
+InstrumentedExecutor wraps a ThreadPoolExecutor or ProcessPoolExecutor. For each task it records when it was
+submitted, when a worker started and finished it and which worker (process id and thread) ran it. From that it derives
+queue wait and run time per task, completion rate and ETA while the executor is running, a summary with per worker
+statistics and stragglers at the end and a per task timeline in Chrome trace format (chrome://tracing or
+https://ui.perfetto.dev).
+"""
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict
+
+log = logging.getLogger(__name__)
+
+
+class TaskRecord:
+    """
+    Timing of a single task; all times are time.time() values so that they can be compared across processes
+    """
+    __slots__ = ('task_id', 'name', 'submitted', 'started', 'finished', 'pid', 'thread_id', 'thread_name', 'failed')
+
+    def __init__(self, task_id, name, submitted):
+        self.task_id = task_id
+        self.name = name
+        self.submitted = submitted
+        self.started = None
+        self.finished = None
+        self.pid = None
+        self.thread_id = None
+        self.thread_name = None
+        self.failed = False
+
+    @property
+    def queue_wait(self):
+        return self.started - self.submitted
+
+    @property
+    def run_time(self):
+        return self.finished - self.started
+
+    @property
+    def worker(self):
+        return f'{self.pid}/{self.thread_name}'
+
+
+class TimedCall:
+    """
+    Callable executed in the worker: calls the task and returns the result together with start and end time and the
+    identity of the worker. Defined on module level so that it can be pickled for process pools.
+    """
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __call__(self, *args, **kwargs):
+        started = time.time()
+        thread = threading.current_thread()
+        try:
+            result = self.fn(*args, **kwargs)
+        except BaseException as e:
+            return False, e, started, time.time(), os.getpid(), thread.ident, thread.name
+        return True, result, started, time.time(), os.getpid(), thread.ident, thread.name
+
+
+class InstrumentedFuture(concurrent.futures.Future):
+    """
+    Future returned by InstrumentedExecutor; cancelling it cancels the future of the wrapped executor
+    """
+
+    def __init__(self, inner):
+        super().__init__()
+        self.inner = inner
+
+    def cancel(self):
+        return self.inner.cancel() and super().cancel()
+
+
+class InstrumentedExecutor(concurrent.futures.Executor):
+    """
+    Executor wrapping another executor and recording queue wait, run time and worker identity of all tasks.
+    Can be used as context manager just like the wrapped executor.
+    """
+
+    def __init__(self, executor, name=None, logger=None):
+        """
+        :param executor: executor to wrap
+        :param name: name used in log messages; default: class name of the wrapped executor
+        :param logger: logger for progress and summary; default: logger of this module
+        """
+        self.executor = executor
+        self.name = name or type(executor).__name__
+        self.log = logger or log
+        self.lock = threading.Lock()
+        self.records = []
+        self.done = 0
+        self.start = None
+
+    def submit(self, fn, *args, **kwargs):
+        submitted = time.time()
+        with self.lock:
+            if self.start is None:
+                self.start = submitted
+            record = TaskRecord(len(self.records), getattr(fn, '__name__', repr(fn)), submitted)
+            self.records.append(record)
+        inner = self.executor.submit(TimedCall(fn), *args, **kwargs)
+        future = InstrumentedFuture(inner)
+        inner.add_done_callback(lambda f: self.task_done(record, future, f))
+        return future
+
+    def task_done(self, record, future, inner):
+        """
+        Callback of the wrapped future: update the record and resolve the future handed out by submit()
+        """
+        if inner.cancelled():
+            future.cancel()
+            future.set_running_or_notify_cancel()
+            return
+        error = inner.exception()
+        if error is not None:
+            # exception in TimedCall or while transporting the result
+            record.failed = True
+            future.set_exception(error)
+            return
+        ok, result, record.started, record.finished, record.pid, record.thread_id, record.thread_name = inner.result()
+        record.failed = not ok
+        with self.lock:
+            self.done += 1
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(result)
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def progress(self):
+        """
+        Live progress
+        :return: tuple: completed tasks, submitted tasks, completion rate in tasks/s, ETA in seconds or None
+        """
+        with self.lock:
+            done, total, start = self.done, len(self.records), self.start
+        if not done:
+            return done, total, 0.0, None
+        rate = done / max(time.time() - start, 1e-9)
+        return done, total, rate, (total - done) / rate
+
+    def progress_line(self):
+        """
+        Progress as single line for log messages
+        """
+        done, total, rate, eta = self.progress()
+        eta = f'{eta:.1f}s' if eta is not None else 'n/a'
+        return f'{done}/{total} done, {rate:.2f} tasks/s, ETA {eta}'
+
+    def completed_records(self):
+        with self.lock:
+            return [r for r in self.records if r.finished is not None]
+
+    def log_summary(self, stragglers=3):
+        """
+        Log queue wait and run time percentiles, per worker statistics and the slowest tasks
+        :param stragglers: number of slowest tasks to log
+        """
+        records = self.completed_records()
+        if not records:
+            self.log.info(f'{self.name}: no completed tasks')
+            return
+        elapsed = max(r.finished for r in records) - min(r.submitted for r in records)
+        failed = sum(r.failed for r in records)
+        self.log.info(f'{self.name}: {len(records)} tasks ({failed} failed) in {elapsed:.3f}s, '
+                      f'{len(records) / max(elapsed, 1e-9):.2f} tasks/s')
+        for label, values in (('queue wait', [r.queue_wait for r in records]),
+                              ('  run time', [r.run_time for r in records])):
+            self.log.info(f'{self.name}: {label}: median {statistics.median(values) * 1000:10.3f}ms, '
+                          f'p95 {percentile(values, 0.95) * 1000:10.3f}ms, max {max(values) * 1000:10.3f}ms')
+        tasks = Counter(r.worker for r in records)
+        busy = defaultdict(float)
+        for r in records:
+            busy[r.worker] += r.run_time
+        for worker in sorted(tasks):
+            self.log.info(f'{self.name}: worker {worker}: {tasks[worker]} tasks, busy {busy[worker] * 1000:10.3f}ms, '
+                          f'utilization {busy[worker] / max(elapsed, 1e-9):6.1%}')
+        median = statistics.median(r.run_time for r in records)
+        for r in sorted(records, key=lambda r: r.run_time, reverse=True)[:stragglers]:
+            self.log.info(f'{self.name}: slowest: task {r.task_id} ({r.name}) on {r.worker}: '
+                          f'run {r.run_time * 1000:10.3f}ms ({r.run_time / max(median, 1e-9):.1f}x median), '
+                          f'queued {r.queue_wait * 1000:10.3f}ms')
+
+    def trace_events(self):
+        """
+        Timeline of all completed tasks as Chrome trace events. Each worker thread is a track; the time a task spent
+        in the queue is shown on a separate 'queue' track of the process which submitted the task.
+        :return: list of trace events
+        """
+        events = []
+        threads = {}
+        submitter = os.getpid()
+        for r in self.completed_records():
+            threads[(r.pid, r.thread_id)] = r.thread_name
+            args = {'task': r.task_id, 'queue_wait_ms': r.queue_wait * 1000, 'failed': r.failed}
+            events.append({'name': r.name, 'cat': 'run', 'ph': 'X', 'ts': r.started * 1e6, 'dur': r.run_time * 1e6,
+                           'pid': r.pid, 'tid': r.thread_id, 'args': args})
+            events.append({'name': f'{r.name} (queued)', 'cat': 'queue', 'ph': 'X', 'ts': r.submitted * 1e6,
+                           'dur': r.queue_wait * 1e6, 'pid': submitter, 'tid': 0, 'args': {'task': r.task_id}})
+        events.append({'name': 'thread_name', 'ph': 'M', 'pid': submitter, 'tid': 0, 'args': {'name': 'queue'}})
+        for (pid, thread_id), thread_name in threads.items():
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                           'args': {'name': thread_name}})
+        return events
+
+    def write_trace(self, path):
+        """
+        Write the timeline in Chrome trace format
+        :param path: path of the JSON file
+        """
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f)
+        self.log.info(f'{self.name}: wrote trace of {len(self.completed_records())} tasks to {path}')
+
+
+def percentile(values, q):
+    """
+    Percentile using linear interpolation between closest ranks
+    :param values: list of numbers
+    :param q: quantile; 0 <= q <= 1
+    :return: percentile
+    """
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def as_completed(executor, futures, log_every=1.0):
+    """
+    Like concurrent.futures.as_completed(), but logs progress of an InstrumentedExecutor at most every log_every
+    seconds
+    :param executor: InstrumentedExecutor
+    :param futures: iterable of futures
+    :param log_every: min time between progress log messages in seconds
+    :return: generator of completed futures
+    """
+    last = time.perf_counter()
+    for completed_future in concurrent.futures.as_completed(futures):
+        yield completed_future
+        if time.perf_counter() - last >= log_every:
+            last = time.perf_counter()
+            executor.log.info(f'{executor.name}: {executor.progress_line()}')
+
+
+def sleepy_task(i):
+    """
+    Demo task: sleep for a random time; every 10th task is a straggler
+    """
+    time.sleep(random.uniform(0.05, 0.1) * (5 if not i % 10 else 1))
+    return i
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Instrumented executor demo')
+    parser.add_argument('--tasks', type=int, default=40, help='number of tasks')
+    parser.add_argument('--max-workers', type=int, default=4, help='number of worker threads/processes')
+    parser.add_argument('--processes', action='store_true', help='use a process pool instead of a thread pool')
+    parser.add_argument('--trace', default='trace.json', help='path of the Chrome trace file')
+    args = parser.parse_args()
+
+    executor_class = (concurrent.futures.ProcessPoolExecutor if args.processes
+                      else concurrent.futures.ThreadPoolExecutor)
+    with InstrumentedExecutor(executor_class(max_workers=args.max_workers)) as executor:
+        futures = [executor.submit(sleepy_task, i) for i in range(args.tasks)]
+        for completed_future in as_completed(executor, futures, log_every=0.5):
+            completed_future.result()
+    executor.log_summary()
+    executor.write_trace(args.trace)
+
+
+if __name__ == '__main__':
+    f = logging.Formatter('%(asctime)s [%(levelname)s] [%(process)d] [%(threadName)s] %(name)s: %(message)s')
+    h = logging.StreamHandler()
+    h.setFormatter(f)
+    log.addHandler(h)
+    log.setLevel(logging.INFO)
+
+    main()
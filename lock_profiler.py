@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""
+Lock contention profiler.
+
+ProfiledLock is a drop-in replacement for threading.Lock: acquire(), release(), locked() and use as context manager.
+For each acquisition it records whether the lock was contended, how long the thread waited for the lock and how long
+it held it. Wait and hold times go into histograms with power of two buckets so that recording is cheap: the
+statistics are updated while the lock is held, no additional lock is needed.
+
+report() logs acquisitions, contention, wait and hold time percentiles and histograms and the threads which held the
+lock the longest. contention_report() logs the report for a set of locks when a block of code (e.g. the with block of
+an executor) is done.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import itertools
+import logging
+import threading
+import time
+import weakref
+from collections import defaultdict
+
+log = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    Histogram of durations with power of two buckets in nanoseconds
+    """
+    __slots__ = ('buckets', 'total', 'max')
+
+    def __init__(self):
+        # bucket i holds durations in [2 ** (i - 1), 2 ** i) ns
+        self.buckets = [0] * 64
+        self.total = 0
+        self.max = 0
+
+    def add(self, ns):
+        self.buckets[ns.bit_length()] += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    @property
+    def count(self):
+        return sum(self.buckets)
+
+    def percentile(self, q):
+        """
+        Upper bound of the bucket containing the given percentile
+        :param q: quantile; 0 <= q <= 1
+        :return: duration in ns
+        """
+        rank = q * self.count
+        seen = 0
+        for bucket, n in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min(2 ** bucket, self.max)
+        return self.max
+
+    def lines(self, width=40):
+        """
+        Text rendering of the histogram
+        :param width: width of the largest bar
+        :return: list of lines
+        """
+        largest = max(self.buckets)
+        return [f'{format_ns(2 ** (bucket - 1) if bucket else 0):>9} - {format_ns(2 ** bucket):>9}: '
+                f'{"#" * max(1, round(width * n / largest)):{width}} {n}'
+                for bucket, n in enumerate(self.buckets) if n]
+
+
+def format_ns(ns):
+    for unit, scale in (('s', 1e9), ('ms', 1e6), ('us', 1e3)):
+        if ns >= scale:
+            return f'{ns / scale:.1f}{unit}'
+    return f'{ns}ns'
+
+
+# all profiled locks still alive; weak references so that profiling doesn't keep locks alive
+_locks = weakref.WeakSet()
+_locks_lock = threading.Lock()
+# numbers for default lock names
+_lock_numbers = itertools.count()
+
+
+class ProfiledLock:
+    """
+    threading.Lock with wait and hold time statistics
+    """
+
+    def __init__(self, name=None):
+        """
+        :param name: name used in the report; default: lock-<n>
+        """
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait = Histogram()
+        self.hold = Histogram()
+        # thread id -> total hold time in ns
+        self.hold_by_thread = defaultdict(int)
+        # thread id -> thread name
+        self.thread_names = {}
+        # thread id of the current owner or None
+        self.owner = None
+        self._acquired = 0
+        with _locks_lock:
+            self.name = name or f'lock-{next(_lock_numbers)}'
+            _locks.add(self)
+
+    def acquire(self, blocking=True, timeout=-1):
+        # try w/o blocking first: uncontended acquisitions don't pay for timing the wait
+        if self._lock.acquire(False):
+            wait = 0
+        elif not blocking:
+            return False
+        else:
+            start = time.perf_counter_ns()
+            if not self._lock.acquire(True, timeout):
+                return False
+            wait = time.perf_counter_ns() - start
+            self.contended += 1
+        # from here on we hold the lock: statistics can be updated w/o additional locking
+        self.acquisitions += 1
+        self.wait.add(wait)
+        self.owner = owner = threading.get_ident()
+        if owner not in self.thread_names:
+            self.thread_names[owner] = threading.current_thread().name
+        self._acquired = time.perf_counter_ns()
+        return True
+
+    def release(self):
+        held = time.perf_counter_ns() - self._acquired
+        self.hold.add(held)
+        self.hold_by_thread[self.owner] += held
+        self.owner = None
+        self._lock.release()
+
+    def locked(self):
+        return self._lock.locked()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def reset(self):
+        """
+        Reset all statistics; only call while no other thread uses the lock
+        """
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait = Histogram()
+        self.hold = Histogram()
+        self.hold_by_thread.clear()
+        self.thread_names.clear()
+
+    def report(self, logger=None, histograms=True, top_threads=3):
+        """
+        Log a contention report
+        :param logger: logger to use; default: logger of this module
+        :param histograms: also log wait and hold time histograms
+        :param top_threads: number of threads with the longest total hold time to log
+        """
+        logger = logger or log
+        if not self.acquisitions:
+            logger.info(f'{self.name}: never acquired')
+            return
+        logger.info(f'{self.name}: {self.acquisitions} acquisitions, {self.contended} contended '
+                    f'({self.contended / self.acquisitions:.1%}), total wait {format_ns(self.wait.total)}, '
+                    f'total hold {format_ns(self.hold.total)}')
+        for label, histogram in (('wait', self.wait), ('hold', self.hold)):
+            if not histogram.count:
+                continue
+            logger.info(f'{self.name}: {label}: mean {format_ns(histogram.total // histogram.count)}, '
+                        f'p50 <= {format_ns(histogram.percentile(0.5))}, '
+                        f'p99 <= {format_ns(histogram.percentile(0.99))}, max {format_ns(histogram.max)}')
+            if histograms:
+                for line in histogram.lines():
+                    logger.info(f'{self.name}: {label}: {line}')
+        for thread, held in sorted(self.hold_by_thread.items(), key=lambda item: item[1], reverse=True)[:top_threads]:
+            logger.info(f'{self.name}: held by {self.thread_names.get(thread, thread)} for {format_ns(held)} in total')
+
+
+def report_all(logger=None, histograms=True):
+    """
+    Log contention reports for all profiled locks, most contended first
+    :param logger: logger to use; default: logger of this module
+    :param histograms: also log wait and hold time histograms
+    """
+    with _locks_lock:
+        locks = list(_locks)
+    for lock in sorted(locks, key=lambda lock: lock.wait.total, reverse=True):
+        lock.report(logger=logger, histograms=histograms)
+
+
+@contextlib.contextmanager
+def contention_report(*locks, logger=None, histograms=True):
+    """
+    Context manager logging a contention report for the given locks (default: all profiled locks) on exit. To get the
+    report when an executor is done, enter this context before the executor:
+    with contention_report(counter_lock), ThreadPoolExecutor() as executor:
+    :param locks: profiled locks
+    :param logger: logger to use; default: logger of this module
+    :param histograms: also log wait and hold time histograms
+    """
+    try:
+        yield
+    finally:
+        if locks:
+            for lock in locks:
+                lock.report(logger=logger, histograms=histograms)
+        else:
+            report_all(logger=logger, histograms=histograms)
+
+
+def critical_section(lock, counter, work):
+    """
+    Demo task: read-modify-write of a counter with some work while holding the lock
+    """
+    with lock:
+        val = counter[0]
+        time.sleep(work)
+        counter[0] = val + 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lock contention profiler demo')
+    parser.add_argument('--tasks', type=int, default=200, help='number of tasks')
+    parser.add_argument('--max-workers', type=int, default=8, help='number of worker threads')
+    parser.add_argument('--work', type=float, default=0.001, help='time in seconds spent in the critical section')
+    args = parser.parse_args()
+
+    lock = ProfiledLock('counter_lock')
+    counter = [0]
+    with contention_report(lock), concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        for _ in range(args.tasks):
+            executor.submit(critical_section, lock, counter, args.work)
+    log.info(f'final value: {counter[0]}')
+
+
+if __name__ == '__main__':
+    f = logging.Formatter('%(asctime)s [%(levelname)s] [%(threadName)s] %(name)s: %(message)s')
+    h = logging.StreamHandler()
+    h.setFormatter(f)
+    log.addHandler(h)
+    log.setLevel(logging.INFO)
+
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+Thread pool executor with priorities and fair share between tenants.
+
+ThreadPoolExecutor runs tasks strictly in submission order: a burst of cheap tasks waits behind expensive ones and a
+caller submitting many tasks starves everybody else. PriorityExecutor has the concurrent.futures.Executor interface
+and schedules:
+* by priority first: lower values run first; e.g. the estimated cost of a task for shortest job first
+* round robin between tenants with pending tasks of the best priority: each caller gets its fair share of workers
+* in submission order for tasks of the same tenant and priority
+"""
+import argparse
+import collections
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import math
+import os
+import random
+import statistics
+import threading
+import time
+
+from instrumentation import percentile
+
+log = logging.getLogger(__name__)
+
+
+class WorkItem:
+    __slots__ = ('future', 'fn', 'args', 'kwargs')
+
+    def __init__(self, future, fn, args, kwargs):
+        self.future = future
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+
+class PriorityExecutor(concurrent.futures.Executor):
+    """
+    Executor running tasks in a pool of threads ordered by priority and fair share between tenants
+    """
+
+    def __init__(self, max_workers=None, thread_name_prefix='PriorityExecutor'):
+        """
+        :param max_workers: number of worker threads; default: same as ThreadPoolExecutor
+        :param thread_name_prefix: prefix for names of the worker threads
+        """
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.thread_name_prefix = thread_name_prefix
+        self.condition = threading.Condition()
+        # tenant -> heap of (priority, sequence number, work item); order of tenants is round robin order
+        self.queues = collections.OrderedDict()
+        self.sequence = itertools.count()
+        self.threads = []
+        # number of queued work items and of workers waiting for work
+        self.pending = 0
+        self.idle = 0
+        self.shutting_down = False
+
+    def submit(self, fn, /, *args, **kwargs):
+        """
+        Submit a task with default priority (0) for the default tenant (None)
+        """
+        return self.submit_with(0, None, fn, *args, **kwargs)
+
+    def submit_with(self, priority, tenant, fn, /, *args, **kwargs):
+        """
+        Submit a task
+        :param priority: lower values run first
+        :param tenant: caller the task is accounted to for fair share; any hashable
+        :param fn: function to call
+        :return: future
+        """
+        future = concurrent.futures.Future()
+        with self.condition:
+            if self.shutting_down:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            heapq.heappush(self.queues.setdefault(tenant, []),
+                           (priority, next(self.sequence), WorkItem(future, fn, args, kwargs)))
+            self.pending += 1
+            if self.idle:
+                self.condition.notify()
+            # idle workers might not have picked up earlier items yet: only they don't need a new thread
+            if self.pending > self.idle and len(self.threads) < self.max_workers:
+                t = threading.Thread(target=self.worker, name=f'{self.thread_name_prefix}_{len(self.threads)}',
+                                     daemon=True)
+                self.threads.append(t)
+                t.start()
+        return future
+
+    def next_item(self):
+        """
+        Pop the next work item; needs to be called with the condition held
+        :return: work item or None if there is no pending work
+        """
+        if not self.queues:
+            return None
+        best = min(heap[0][0] for heap in self.queues.values())
+        # round robin: first tenant in round robin order with a task of the best priority
+        for tenant, heap in self.queues.items():
+            if heap[0][0] == best:
+                break
+        _, _, item = heapq.heappop(heap)
+        self.pending -= 1
+        self.queues.move_to_end(tenant)
+        if not heap:
+            del self.queues[tenant]
+        return item
+
+    def worker(self):
+        while True:
+            with self.condition:
+                item = self.next_item()
+                while item is None:
+                    if self.shutting_down:
+                        return
+                    self.idle += 1
+                    self.condition.wait()
+                    self.idle -= 1
+                    item = self.next_item()
+            item.run()
+            # drop references to arguments and result early
+            del item
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.condition:
+            self.shutting_down = True
+            if cancel_futures:
+                while (item := self.next_item()) is not None:
+                    item.future.cancel()
+            self.condition.notify_all()
+        if wait:
+            for t in list(self.threads):
+                t.join()
+
+
+def check_burst(tasks=8, max_workers=4, duration=0.2):
+    """
+    Self-test: a burst of tasks submitted while a worker is idle has to be spread over max_workers threads
+    :param tasks: number of tasks in the burst
+    :param max_workers: number of worker threads
+    :param duration: duration of a task in seconds
+    :return: None
+    """
+    with PriorityExecutor(max_workers=max_workers) as executor:
+        # leave one idle worker behind
+        executor.submit(time.sleep, 0).result()
+        start = time.perf_counter()
+        futures = [executor.submit(time.sleep, duration) for _ in range(tasks)]
+        concurrent.futures.wait(futures)
+        elapsed = time.perf_counter() - start
+        threads = len(executor.threads)
+    expected = math.ceil(tasks / max_workers) * duration
+    if threads != max_workers or elapsed > 1.5 * expected:
+        raise AssertionError(f'burst of {tasks} tasks: {threads} threads, {elapsed * 1000:.1f}ms; '
+                             f'expected {max_workers} threads, {expected * 1000:.1f}ms')
+    log.info(f'burst of {tasks} tasks: {threads} threads, {elapsed * 1000:.1f}ms')
+
+
+def benchmark(tasks=400, max_workers=4, bulk_expensive=0.8, interactive_expensive=0.2, expensive=0.02, cheap=0.001):
+    """
+    Latency (submit to completion) per priority class and tenant: FIFO ThreadPoolExecutor vs. PriorityExecutor.
+    Tenant 'bulk' submits a burst of mostly expensive tasks first, then tenant 'interactive' submits mostly cheap
+    tasks. Tasks sleep to simulate work. With the PriorityExecutor cheap tasks get priority 0 and expensive ones
+    priority 1.
+    :param tasks: number of tasks per tenant
+    :param max_workers: number of worker threads
+    :param bulk_expensive: share of expensive tasks of the bulk tenant
+    :param interactive_expensive: share of expensive tasks of the interactive tenant
+    :param expensive: duration of an expensive task in seconds
+    :param cheap: duration of a cheap task in seconds
+    :return: None
+    """
+    random.seed(0)
+    workload = [('bulk', expensive if random.random() < bulk_expensive else cheap) for _ in range(tasks)]
+    workload += [('interactive', expensive if random.random() < interactive_expensive else cheap)
+                 for _ in range(tasks)]
+
+    def work(duration, submitted):
+        time.sleep(duration)
+        return time.perf_counter() - submitted
+
+    for name in ('FIFO', 'priority + fair share'):
+        if name == 'FIFO':
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            executor = PriorityExecutor(max_workers=max_workers)
+        futures = []
+        with executor:
+            for tenant, duration in workload:
+                if name == 'FIFO':
+                    future = executor.submit(work, duration, time.perf_counter())
+                else:
+                    future = executor.submit_with(0 if duration == cheap else 1, tenant, work, duration,
+                                                  time.perf_counter())
+                futures.append(((tenant, 'cheap' if duration == cheap else 'expensive'), future))
+        latencies = collections.defaultdict(list)
+        for key, future in futures:
+            latencies[key].append(future.result())
+        log.info('=' * 100)
+        for (tenant, cost), values in sorted(latencies.items()):
+            log.info(f'{name:>21}: {tenant:>11}, {cost:>9}: {len(values):4} tasks, '
+                     f'p50 {statistics.median(values) * 1000:9.1f}ms, '
+                     f'p95 {percentile(values, 0.95) * 1000:9.1f}ms, '
+                     f'p99 {percentile(values, 0.99) * 1000:9.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare FIFO and priority/fair share scheduling')
+    parser.add_argument('--tasks', type=int, default=400, help='number of tasks per tenant')
+    parser.add_argument('--max-workers', type=int, default=4, help='number of worker threads')
+    args = parser.parse_args()
+    check_burst(max_workers=args.max_workers)
+    benchmark(tasks=args.tasks, max_workers=args.max_workers)
+
+
+if __name__ == '__main__':
+    f = logging.Formatter('%(asctime)s [%(levelname)s] [%(threadName)s] %(name)s: %(message)s')
+    h = logging.StreamHandler()
+    h.setFormatter(f)
+    log.addHandler(h)
+    log.setLevel(logging.INFO)
+
+    main()
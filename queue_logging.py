@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""
+Non-blocking logging for threaded code.
+
+A StreamHandler formats each record and writes it to the stream in the thread which logs, holding the handler lock.
+With many threads the handler lock and the write become a serialization point; if a thread logs while holding another
+lock (like update_counter_context() in the examples) the write even stretches that critical section.
+
+setup_logging() instead attaches a LazyQueueHandler: logging threads only put the record into a queue. A
+QueueListener thread formats the records and writes them, optionally as batched JSON lines (JsonBatchHandler).
+"""
+import argparse
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from instrumentation import percentile
+
+log = logging.getLogger(__name__)
+
+LOG_MODES = ['sync', 'queue', 'json']
+
+# listeners started by setup_logging() and not stopped yet
+_running_listeners = set()
+_running_listeners_lock = threading.Lock()
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler which defers all formatting to the listener thread. The standard QueueHandler formats the message in
+    the logging thread so that the record can be pickled; with a queue.Queue between threads that's not necessary.
+    Messages are merged with their arguments in the listener: log with %-style arguments, not with f-strings, to keep
+    the formatting cost out of the logging thread. Arguments have to be immutable or not modified after logging.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+class JsonBatchHandler(logging.Handler):
+    """
+    Handler writing one JSON object per record and line. Lines are buffered and written in batches of batch_size
+    records or when flush_interval seconds have passed since the last write. The interval is checked when a record is
+    emitted: behind a BatchQueueListener the buffer is also written once no record arrived for flush_interval seconds.
+    """
+
+    def __init__(self, stream=None, batch_size=100, flush_interval=1.0):
+        """
+        :param stream: stream to write to; default: sys.stderr
+        :param batch_size: max number of records per write
+        :param flush_interval: max time in seconds a record is buffered
+        """
+        super().__init__()
+        self.stream = stream or sys.stderr
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def emit(self, record):
+        try:
+            entry = {'time': record.created, 'level': record.levelname, 'logger': record.name,
+                     'process': record.process, 'thread': record.threadName, 'message': record.getMessage()}
+            if record.exc_info:
+                entry['exc_info'] = self.formatException(record.exc_info)
+            line = json.dumps(entry)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.lock:
+            self.buffer.append(line)
+            if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.stream.write('\n'.join(self.buffer) + '\n')
+            self.buffer.clear()
+        self.stream.flush()
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+class BatchQueueListener(logging.handlers.QueueListener):
+    """
+    QueueListener which flushes its handlers when no record arrived for flush_interval seconds: buffered records of a
+    JsonBatchHandler are not held back until the next record arrives
+    """
+
+    def __init__(self, log_queue, *handlers, flush_interval=1.0, respect_handler_level=False):
+        super().__init__(log_queue, *handlers, respect_handler_level=respect_handler_level)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        if not block:
+            return self.queue.get(block)
+        try:
+            return self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            # idle: write buffered records, then wait for the next record
+            for handler in self.handlers:
+                handler.flush()
+            return self.queue.get()
+
+
+def setup_logging(logger, formatter, mode='sync', stream=None, batch_size=100):
+    """
+    Attach a handler to a logger
+    :param logger: logger
+    :param formatter: formatter for sync and queue mode
+    :param mode: sync: StreamHandler; queue: records are formatted and written by a listener thread; json: like queue
+        but records are written as batched JSON lines
+    :param stream: stream to write to; default: sys.stderr
+    :param batch_size: max number of records per write in json mode
+    :return: QueueListener or None; the listener is stopped (and all queued records are written) at exit
+    """
+    if mode not in LOG_MODES:
+        raise ValueError(f'unknown log mode: {mode}')
+    if mode == 'json':
+        handler = JsonBatchHandler(stream, batch_size=batch_size)
+    else:
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(formatter)
+    if mode == 'sync':
+        logger.addHandler(handler)
+        return None
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(LazyQueueHandler(log_queue))
+    if mode == 'json':
+        listener = BatchQueueListener(log_queue, handler, flush_interval=handler.flush_interval)
+    else:
+        listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    with _running_listeners_lock:
+        _running_listeners.add(listener)
+    atexit.register(stop_listener, listener)
+    return listener
+
+
+def stop_listener(listener):
+    """
+    Stop a listener after all queued records have been handled and flush its handlers
+    """
+    with _running_listeners_lock:
+        if listener not in _running_listeners:
+            # already stopped
+            return
+        _running_listeners.remove(listener)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.flush()
+
+
+def task(i, lock, counter, hold_times, logger):
+    """
+    Benchmark task: increment a counter and log while holding the lock, like update_counter_context() in the examples
+    """
+    with lock:
+        acquired = time.perf_counter()
+        val = counter[0]
+        logger.info('(%s): previous value: %s', i, val)
+        counter[0] = val + 1
+        logger.info('(%s): Done, set new value: %s', i, val + 1)
+        hold_times.append(time.perf_counter() - acquired)
+
+
+def benchmark(tasks=20000, threads=8, modes=None):
+    """
+    Lock hold time and tasks/s with logging in the critical section: logging off, and the log modes writing to a
+    temporary file
+    :param tasks: number of tasks
+    :param threads: number of threads
+    :param modes: log modes; default: all
+    :return: None
+    """
+    formatter = logging.Formatter('%(asctime)s [%(levelname)s] [%(threadName)s] %(name)s: %(message)s')
+    results = []
+    for mode in ['off'] + (modes or LOG_MODES):
+        logger = logging.getLogger(f'{__name__}.benchmark.{mode}')
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        with tempfile.TemporaryFile('w+') as stream:
+            listener = None
+            if mode == 'off':
+                logger.setLevel(logging.WARNING)
+            else:
+                listener = setup_logging(logger, formatter, mode=mode, stream=stream)
+            lock = threading.Lock()
+            counter = [0]
+            hold_times = []
+
+            def worker(first):
+                for i in range(first, tasks, threads):
+                    task(i, lock, counter, hold_times, logger)
+
+            workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+            start = time.perf_counter()
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+            elapsed = time.perf_counter() - start
+            # time until all records have been written
+            if listener:
+                stop_listener(listener)
+            drained = time.perf_counter() - start
+            for handler in logger.handlers:
+                handler.flush()
+            stream.seek(0)
+            lines = sum(1 for _ in stream)
+        logger.handlers.clear()
+        results.append((mode, statistics.mean(hold_times), percentile(hold_times, 0.99),
+                        tasks / elapsed, drained, lines))
+    for mode, mean, p99, rate, drained, lines in results:
+        log.info(f'{mode:>5}: lock hold time mean {mean * 1e6:8.2f}us, p99 {p99 * 1e6:8.2f}us, '
+                 f'{rate:10,.0f} tasks/s, all records written after {drained * 1000:8.1f}ms ({lines} lines)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark logging modes with logging in a critical section')
+    parser.add_argument('--tasks', type=int, default=20000, help='number of tasks')
+    parser.add_argument('--threads', type=int, default=8, help='number of threads')
+    args = parser.parse_args()
+    benchmark(tasks=args.tasks, threads=args.threads)
+
+
+if __name__ == '__main__':
+    f = logging.Formatter('%(asctime)s [%(levelname)s] [%(process)d] [%(threadName)s] %(name)s: %(message)s')
+    h = logging.StreamHandler()
+    h.setFormatter(f)
+    log.addHandler(h)
+    log.setLevel(logging.INFO)
+
+    main()
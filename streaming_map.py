@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Lazy map over an executor with a bounded number of tasks in flight.
+
+Executor.map() submits a task for every input item before it yields the first result: the input iterable is consumed
+completely and all futures (and their results) stay in memory until they are yielded. That doesn't work for endless
+input and memory grows with the input size.
+
+bounded_map() only keeps window tasks in flight: the next input item is read and submitted when a result has been
+yielded. Results are yielded in input order (like Executor.map()) or in completion order.
+"""
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import logging
+import os
+import time
+import tracemalloc
+
+log = logging.getLogger(__name__)
+
+
+def call_chunk(fn, chunk):
+    """
+    Apply fn to a chunk of argument tuples; runs in the worker. Defined on module level so that it can be pickled for
+    process pools
+    :param fn: function to call
+    :param chunk: list of argument tuples
+    :return: list of results
+    """
+    return [fn(*args) for args in chunk]
+
+
+def bounded_map(executor, fn, *iterables, window=None, ordered=True, chunksize=1):
+    """
+    Like executor.map(fn, *iterables) but lazy: only window tasks are in flight at any time. The iterables are consumed
+    as results are yielded and can be generators of any length, including endless ones.
+    Closing the generator (or leaving a for loop over it early) cancels all tasks which have not started yet.
+    :param executor: executor
+    :param fn: function to call
+    :param iterables: iterables with the arguments for fn
+    :param window: max number of tasks in flight; default: twice the number of workers of the executor
+    :param ordered: True: yield results in input order; False: yield results as soon as they are available
+    :param chunksize: number of items per task; larger chunks reduce the overhead per item for process pools
+    :return: generator of results
+    """
+    if window is None:
+        window = 2 * (getattr(executor, '_max_workers', None) or os.cpu_count())
+    if window < 1:
+        raise ValueError('window must be at least 1')
+    args = zip(*iterables)
+    if chunksize > 1:
+        tasks = iter(lambda: list(itertools.islice(args, chunksize)), [])
+
+        def submit(chunk):
+            return executor.submit(call_chunk, fn, chunk)
+    else:
+        tasks = args
+
+        def submit(task_args):
+            return executor.submit(fn, *task_args)
+
+    if ordered:
+        pending = collections.deque(submit(task) for task in itertools.islice(tasks, window))
+    else:
+        pending = set(submit(task) for task in itertools.islice(tasks, window))
+    try:
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                # refill the window before yielding: workers stay busy while the consumer processes the result
+                for task in itertools.islice(tasks, 1):
+                    if ordered:
+                        pending.append(submit(task))
+                    else:
+                        pending.add(submit(task))
+                if chunksize > 1:
+                    yield from result
+                else:
+                    yield result
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def square(x):
+    return x * x
+
+
+def benchmark(items=200000, max_workers=4, window=None):
+    """
+    Compare executor.map() and bounded_map() streaming many cheap items through a thread pool: time and peak memory
+    :param items: number of items
+    :param max_workers: number of worker threads
+    :param window: window of bounded_map(); default: twice the number of workers
+    :return: None
+    """
+    results = []
+    modes = [('executor.map', lambda executor, it: executor.map(square, it)),
+             ('bounded_map, ordered', lambda executor, it: bounded_map(executor, square, it, window=window)),
+             ('bounded_map, unordered',
+              lambda executor, it: bounded_map(executor, square, it, window=window, ordered=False))]
+    for name, mapper in modes:
+        tracemalloc.start()
+        start = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            total = sum(mapper(executor, iter(range(items))))
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if total != sum(x * x for x in range(items)):
+            raise AssertionError(f'{name}: wrong result')
+        results.append((name, elapsed, peak))
+    for name, elapsed, peak in results:
+        log.info(f'{name:>22}: {items} items in {elapsed * 1000:10.3f}ms, peak memory {peak / 2 ** 20:8.2f} MiB')
+
+    # endless input: only possible with bounded_map()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        first = list(itertools.islice(bounded_map(executor, square, itertools.count(), window=window), 5))
+    log.info(f'first results for endless input: {first}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare executor.map() and bounded_map()')
+    parser.add_argument('--items', type=int, default=200000, help='number of items')
+    parser.add_argument('--max-workers', type=int, default=4, help='number of worker threads')
+    parser.add_argument('--window', type=int, help='max number of tasks in flight; default: 2 * max workers')
+    args = parser.parse_args()
+    benchmark(items=args.items, max_workers=args.max_workers, window=args.window)
+
+
+if __name__ == '__main__':
+    f = logging.Formatter('%(asctime)s [%(levelname)s] [%(threadName)s] %(name)s: %(message)s')
+    h = logging.StreamHandler()
+    h.setFormatter(f)
+    log.addHandler(h)
+    log.setLevel(logging.INFO)
+
+    main()